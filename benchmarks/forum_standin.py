@@ -0,0 +1,396 @@
+#!/usr/bin/python3
+"""Local stand-in for the Wayfarer forum API (community.wayfarer.nianticlabs.com/api/v2).
+
+Serves /users, /discussions, /comments and the /reactions endpoints from a
+recorded fixture file or from generated data, with configurable latency,
+error rate and page size. Responses carry an ETag and honour If-None-Match,
+and paged lists send a Link header, like the real forum.
+
+Run standalone from the repository root:
+    python -m benchmarks.forum_standin --port 8047
+then point ForumClient at http://127.0.0.1:8047/api/v2.
+
+A few extra routes drive the server during a benchmark:
+    GET  /_standin/stats                            request counts, by endpoint
+    POST /_standin/stats/reset
+    POST /_standin/activity?comments=N&discussions=N  new staff posts
+    POST /_standin/edits?edits=N&deletions=N          edit or delete recent staff comments
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+STAFF_ROLES = ["Niantic", "Moderator", "Administrator"]
+REACTION_TYPES = ["Like", "Helpful", "Insightful", "Funny", "Disagree"]
+CATEGORY_IDS = [1, 3, 4, 6, 9, 13, 17]
+FORUM_URL = "https://community.wayfarer.nianticlabs.com"
+LOREM = ("Thanks for the report, we are looking into this and will update the thread. Please check the "
+         "Help Center for the current criteria. Photo quality, location accuracy and a clear title all "
+         "help reviewers make a decision.").split()
+
+
+def _date(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+class ForumData:
+    """ The forum content served by the stand-in, held as API-shaped dicts.
+    Comments and discussions are kept in ID order, which is the order the
+    forum pages them in.
+    """
+    def __init__(self, users=None, discussions=None, comments=None, reactions=None, seed=47):
+        self.users = users or []
+        self.discussions = discussions or []
+        self.comments = comments or []
+        # "comments/123" or "discussions/123" -> list of reactions
+        self.reactions = reactions or {}
+        self.random = random.Random(seed)
+        self.now = datetime.now(timezone.utc)
+        self._index()
+
+    def _index(self):
+        self.users_by_id = {u["userID"]: u for u in self.users}
+        self.users_by_name = {u["name"].lower(): u for u in self.users}
+        self.discussions_by_id = {d["discussionID"]: d for d in self.discussions}
+        self.comments_by_id = {c["commentID"]: c for c in self.comments}
+        self.staff = [u for u in self.users if set(u.get("roles", [])) & set(STAFF_ROLES)]
+
+    @classmethod
+    def load(cls, path, seed=47):
+        with open(path, 'r') as fd:
+            fixture = json.load(fd)
+        return cls(fixture.get("users"), fixture.get("discussions"), fixture.get("comments"),
+                   fixture.get("reactions"), seed=seed)
+
+    def save(self, path):
+        with open(path, 'w') as fd:
+            json.dump({"users": self.users, "discussions": self.discussions,
+                       "comments": self.comments, "reactions": self.reactions}, fd)
+
+    @classmethod
+    def generate(cls, staff=12, members=200, discussions=400, comments=4000, max_reactions=30, seed=47):
+        data = cls(seed=seed)
+        rand = data.random
+        start = data.now - timedelta(days=365)
+        for user_id in range(1, staff + members + 1):
+            roles = [rand.choice(STAFF_ROLES)] if user_id <= staff else ["Member"]
+            data.users.append({
+                "userID": user_id,
+                "name": f"Niantic{user_id}-ING" if user_id <= staff else f"Wayfarer{user_id}",
+                "roles": roles,
+                "dateInserted": _date(start),
+                "dateLastActive": _date(start),
+                "countComments": 0,
+                "countDiscussions": 0,
+                "photoUrl": f"{FORUM_URL}/uploads/userpics/{user_id}.png",
+                "url": f"{FORUM_URL}/profile/{user_id}",
+            })
+        data._index()
+        step = timedelta(days=365) / max(discussions + comments, 1)
+        moment = start
+        for __ in range(discussions):
+            moment += step
+            data._add_discussion(rand.choice(data.users), moment, max_reactions)
+        for __ in range(comments):
+            moment += step
+            data._add_comment(rand.choice(data.users), moment, max_reactions)
+        return data
+
+    def _text(self, words):
+        return " ".join(self.random.choice(LOREM) for __ in range(words))
+
+    def _reactions(self, max_reactions):
+        return [{"reactionType": {"name": self.random.choice(REACTION_TYPES)},
+                 "user": {"userID": user["userID"], "name": user["name"]}}
+                for user in self.random.sample(self.users, self.random.randint(0, min(max_reactions,
+                                                                                      len(self.users))))]
+
+    def _touch_user(self, user, moment, counter):
+        user[counter] += 1
+        user["dateLastActive"] = _date(moment)
+
+    def _add_discussion(self, user, moment, max_reactions=30):
+        discussion_id = self.discussions[-1]["discussionID"] + 1 if self.discussions else 1
+        reactions = self._reactions(max_reactions)
+        discussion = {
+            "discussionID": discussion_id,
+            "name": self._text(6).capitalize(),
+            "body": f"<p>{self._text(60)}</p>",
+            "categoryID": self.random.choice(CATEGORY_IDS),
+            "insertUserID": user["userID"],
+            "dateInserted": _date(moment),
+            "dateUpdated": None,
+            "countComments": 0,
+            "score": len(reactions),
+            "url": f"{FORUM_URL}/discussion/{discussion_id}",
+        }
+        self.discussions.append(discussion)
+        self.discussions_by_id[discussion_id] = discussion
+        if reactions:
+            self.reactions[f"discussions/{discussion_id}"] = reactions
+        self._touch_user(user, moment, "countDiscussions")
+        return discussion
+
+    def _add_comment(self, user, moment, max_reactions=30):
+        if not self.discussions:
+            self._add_discussion(user, moment, max_reactions)
+        # IDs are never reused, even after deletions
+        comment_id = self.comments[-1]["commentID"] + 1 if self.comments else 1
+        discussion = self.random.choice(self.discussions)
+        reactions = self._reactions(max_reactions)
+        comment = {
+            "commentID": comment_id,
+            "discussionID": discussion["discussionID"],
+            "name": discussion["name"],
+            "body": f"<p>{self._text(self.random.randint(10, 120))}</p>",
+            "insertUserID": user["userID"],
+            "dateInserted": _date(moment),
+            "dateUpdated": None,
+            "score": len(reactions),
+            "url": f"{FORUM_URL}/discussion/comment/{comment_id}#Comment_{comment_id}",
+        }
+        self.comments.append(comment)
+        self.comments_by_id[comment_id] = comment
+        discussion["countComments"] += 1
+        if reactions:
+            self.reactions[f"comments/{comment_id}"] = reactions
+        self._touch_user(user, moment, "countComments")
+        return comment
+
+    def add_activity(self, comments=0, discussions=0):
+        """Adds new staff posts, dated now, so the next poll has something to find"""
+        authors = self.staff or self.users
+        self.now = datetime.now(timezone.utc)
+        for __ in range(discussions):
+            self._add_discussion(self.random.choice(authors), self.now)
+        for __ in range(comments):
+            self._add_comment(self.random.choice(authors), self.now)
+
+    def edit_recent(self, edits=0, deletions=0, recent=200):
+        """Edits and deletes staff comments among the most recent ones"""
+        staff_ids = {user["userID"] for user in self.staff}
+        candidates = [c for c in self.comments[-recent:] if c["insertUserID"] in staff_ids]
+        self.now = datetime.now(timezone.utc)
+        for comment in self.random.sample(candidates, min(edits, len(candidates))):
+            comment["body"] = comment["body"].replace("</p>", f" Edit: {self._text(8)}</p>")
+            comment["dateUpdated"] = _date(self.now)
+        candidates = [c for c in candidates if c["dateUpdated"] is None]
+        for comment in self.random.sample(candidates, min(deletions, len(candidates))):
+            self.comments.remove(comment)
+            del self.comments_by_id[comment["commentID"]]
+            self.discussions_by_id[comment["discussionID"]]["countComments"] -= 1
+            self.reactions.pop(f"comments/{comment['commentID']}", None)
+
+
+class ForumStandIn:
+    """ aiohttp application serving ForumData the way the forum API does.
+    Every API request waits latency seconds (plus up to jitter more), and
+    fails with a 503 with probability error_rate. limit is capped at
+    max_page_size and defaults to default_page_size.
+    """
+    def __init__(self, data, latency=0.0, jitter=0.0, error_rate=0.0, default_page_size=30,
+                 max_page_size=100, seed=47):
+        self.data = data
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+        self.random = random.Random(seed)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"requests": 0, "not_modified": 0, "errors": 0, "endpoints": {}}
+
+    def app(self):
+        app = web.Application(middlewares=[self._simulate])
+        app.add_routes([
+            web.get('/api/v2/users', self.users),
+            web.get('/api/v2/users/{user}', self.user),
+            web.get('/api/v2/discussions', self.discussions),
+            web.get('/api/v2/discussions/{id:\\d+}', self.discussion),
+            web.get('/api/v2/comments', self.comments),
+            web.get('/api/v2/comments/{id:\\d+}', self.comment),
+            web.get('/api/v2/{kind:comments|discussions}/{id:\\d+}/reactions', self.reactions),
+            web.get('/_standin/stats', self.get_stats),
+            web.post('/_standin/stats/reset', self.post_reset_stats),
+            web.post('/_standin/activity', self.post_activity),
+            web.post('/_standin/edits', self.post_edits),
+        ])
+        return app
+
+    @web.middleware
+    async def _simulate(self, request, handler):
+        if request.path.startswith('/_standin/'):
+            return await handler(request)
+        endpoint = request.match_info.route.resource.canonical if request.match_info.route.resource else "unknown"
+        self.stats["requests"] += 1
+        self.stats["endpoints"][endpoint] = self.stats["endpoints"].get(endpoint, 0) + 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"message": "Service Unavailable", "status": 503}, status=503)
+        response = await handler(request)
+        if response.status == 200 and request.headers.get('If-None-Match') == response.headers.get('ETag'):
+            self.stats["not_modified"] += 1
+            return web.Response(status=304, headers={'ETag': response.headers['ETag']})
+        return response
+
+    def _json(self, body, headers=None):
+        text = json.dumps(body)
+        headers = dict(headers or {})
+        headers['ETag'] = '"' + hashlib.sha1(text.encode()).hexdigest() + '"'
+        return web.Response(text=text, content_type='application/json', headers=headers)
+
+    @staticmethod
+    def _not_found(message):
+        return web.json_response({"message": message, "status": 404}, status=404)
+
+    def _page(self, request, items):
+        try:
+            page = max(int(request.query.get('page', 1)), 1)
+            limit = min(max(int(request.query.get('limit', self.default_page_size)), 1), self.max_page_size)
+        except ValueError:
+            return web.json_response({"message": "page and limit must be integers", "status": 400}, status=400)
+        start = (page - 1) * limit
+        links = []
+        if page > 1:
+            links.append(f'<{request.url.update_query(page=page - 1)}>; rel="prev"')
+        if start + limit < len(items):
+            links.append(f'<{request.url.update_query(page=page + 1)}>; rel="next"')
+        return self._json(items[start:start + limit], {'Link': ", ".join(links)} if links else None)
+
+    @staticmethod
+    def _int_param(request, name):
+        value = request.query.get(name)
+        return int(value) if value is not None and value.isdigit() else None
+
+    async def users(self, request):
+        users = self.data.users
+        role = request.query.get('roleID')
+        if role:
+            role = role.split(':', 1)[-1]
+            users = [u for u in users if role in u.get("roles", [])]
+        return self._page(request, users)
+
+    async def user(self, request):
+        ident = request.match_info['user']
+        if ident.startswith('$name:'):
+            user = self.data.users_by_name.get(ident[6:].lower())
+        elif ident.isdigit():
+            user = self.data.users_by_id.get(int(ident))
+        else:
+            user = self.data.users_by_name.get(ident.lower())
+        if user is None:
+            return self._not_found("User not found.")
+        return self._json(user)
+
+    async def discussions(self, request):
+        discussions = self.data.discussions
+        user_id = self._int_param(request, 'insertUserID')
+        if user_id is not None:
+            discussions = [d for d in discussions if d["insertUserID"] == user_id]
+        return self._page(request, discussions)
+
+    async def discussion(self, request):
+        discussion = self.data.discussions_by_id.get(int(request.match_info['id']))
+        if discussion is None:
+            return self._not_found("Discussion not found.")
+        return self._json(discussion)
+
+    async def comments(self, request):
+        comments = self.data.comments
+        user_id = self._int_param(request, 'insertUserID')
+        discussion_id = self._int_param(request, 'discussionID')
+        if user_id is not None:
+            comments = [c for c in comments if c["insertUserID"] == user_id]
+        if discussion_id is not None:
+            comments = [c for c in comments if c["discussionID"] == discussion_id]
+        return self._page(request, comments)
+
+    async def comment(self, request):
+        comment = self.data.comments_by_id.get(int(request.match_info['id']))
+        if comment is None:
+            return self._not_found("Comment not found.")
+        return self._json(comment)
+
+    async def reactions(self, request):
+        kind, item_id = request.match_info['kind'], int(request.match_info['id'])
+        items = self.data.comments_by_id if kind == "comments" else self.data.discussions_by_id
+        if item_id not in items:
+            return self._not_found(f"{kind[:-1].capitalize()} not found.")
+        return self._page(request, self.data.reactions.get(f"{kind}/{item_id}", []))
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    async def post_reset_stats(self, request):
+        self.reset_stats()
+        return web.json_response(self.stats)
+
+    async def post_activity(self, request):
+        self.data.add_activity(comments=int(request.query.get('comments', 0)),
+                               discussions=int(request.query.get('discussions', 0)))
+        return web.json_response({"comments": len(self.data.comments),
+                                  "discussions": len(self.data.discussions)})
+
+    async def post_edits(self, request):
+        self.data.edit_recent(edits=int(request.query.get('edits', 0)),
+                              deletions=int(request.query.get('deletions', 0)))
+        return web.json_response({"comments": len(self.data.comments)})
+
+
+def add_server_args(parser):
+    parser.add_argument("--fixture", "-f",
+                        help="Serve a recorded fixture (JSON with users, discussions, comments, reactions) "
+                             "instead of generated data.")
+    parser.add_argument("--staff", type=int, default=12, help="Generated staff accounts.")
+    parser.add_argument("--members", type=int, default=200, help="Generated non-staff accounts.")
+    parser.add_argument("--discussions", type=int, default=400, help="Generated discussions.")
+    parser.add_argument("--comments", type=int, default=4000, help="Generated comments.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every API request.")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Up to this many more seconds per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of API requests answered with a 503.")
+    parser.add_argument("--page-size", type=int, default=30, help="Page size when no limit is given.")
+    parser.add_argument("--max-page-size", type=int, default=100, help="Largest limit the server honours.")
+    parser.add_argument("--seed", type=int, default=47, help="Seed for generated data, latency and errors.")
+
+
+def build_standin(args):
+    if args.fixture:
+        data = ForumData.load(args.fixture, seed=args.seed)
+    else:
+        data = ForumData.generate(staff=args.staff, members=args.members, discussions=args.discussions,
+                                  comments=args.comments, seed=args.seed)
+    return ForumStandIn(data, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        default_page_size=args.page_size, max_page_size=args.max_page_size, seed=args.seed)
+
+
+def parse_cli_args():
+    parser = argparse.ArgumentParser(description="Local Wayfarer forum API stand-in")
+    add_server_args(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", "-p", type=int, default=8047)
+    parser.add_argument("--save-fixture",
+                        help="Write the served data to this file, to reuse later with --fixture.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cli_args()
+    standin = build_standin(args)
+    if args.save_fixture:
+        standin.data.save(args.save_fixture)
+    web.run_app(standin.app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
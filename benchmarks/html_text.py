@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+"""Compares clippy.forumhtml.html_to_text against the BeautifulSoup path it replaced.
+
+Run from the repository root: python -m benchmarks.html_text
+"""
+
+import argparse
+import random
+import timeit
+
+from bs4 import BeautifulSoup
+
+from clippy.forumhtml import html_to_text, TextCache
+
+PARAGRAPHS = [
+    "<p>Thanks for the report! We&rsquo;re looking into this &amp; will update the thread.</p>",
+    "<blockquote class=\"Quote\"><div><a href=\"https://community.wayfarer.nianticlabs.com/profile/x\">x</a> "
+    "wrote:</div><div>Is the &quot;Wayspot&quot; criteria changing?</div></blockquote>",
+    "<p>Please see the <a href=\"https://wayfarer.nianticlabs.com/help\">Help Center</a> for details.<br></p>",
+    "<ul><li>Photo quality</li><li>Location accuracy &#8211; within 5m</li><li>Title &amp; description</li></ul>",
+    # whitespace between tags, which BeautifulSoup collapses everywhere but inside pre
+    "\n\n<p>Steps to reproduce:</p>\n  <ol>\n    <li>Open a nomination</li>\n    <li>Edit the title</li>\n  </ol>\n",
+    "<pre>  indented\n\n  code  </pre>\n \n",
+]
+
+
+def parse_cli_args():
+    parser = argparse.ArgumentParser(description="html_to_text micro-benchmark")
+    parser.add_argument("--paragraphs", "-p", type=int, default=40,
+                        help="Paragraphs per generated comment body.")
+    parser.add_argument("--limit", "-l", type=int, default=280,
+                        help="Character limit, as used by the comment embeds.")
+    parser.add_argument("--number", "-n", type=int, default=2000,
+                        help="Parses per measurement.")
+    return parser.parse_args()
+
+
+def make_body(paragraphs):
+    return "".join(random.choice(PARAGRAPHS) for _ in range(paragraphs))
+
+
+def main():
+    args = parse_cli_args()
+    random.seed(47)
+    body = make_body(args.paragraphs)
+    for paragraph in PARAGRAPHS:
+        assert html_to_text(paragraph) == BeautifulSoup(paragraph, 'html.parser').get_text()
+    expected = BeautifulSoup(body, 'html.parser').get_text()
+    assert html_to_text(body) == expected
+    assert html_to_text(body, args.limit)[:args.limit + 1] == expected[:args.limit + 1]
+
+    cache = TextCache()
+    timings = {
+        "BeautifulSoup get_text": lambda: BeautifulSoup(body, 'html.parser').get_text()[:args.limit],
+        "html_to_text (full)": lambda: html_to_text(body),
+        f"html_to_text (limit={args.limit})": lambda: html_to_text(body, args.limit),
+        "TextCache (memoized)": lambda: cache.text(("comment", 1), body, args.limit),
+    }
+    print(f"Body: {len(body)} characters, {args.number} parses each")
+    baseline = None
+    for name, func in timings.items():
+        seconds = min(timeit.repeat(func, number=args.number, repeat=3))
+        per_call = seconds / args.number * 1e6
+        if baseline is None:
+            baseline = per_call
+        print(f"{name:<32} {per_call:10.1f} us/call  {baseline / per_call:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+"""Runs CommentScrapeCog.check_for_updates against the local forum stand-in.
+
+The stand-in runs in its own process so the CPU time reported is the
+scraper's alone. The first cycle sweeps every staff member's full history
+(cold); each following cycle adds new staff posts on the stand-in and polls
+again (warm). Everything is written to a temporary directory.
+
+Run from the repository root: python -m benchmarks.scraper
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.forum_standin import add_server_args, build_standin
+
+
+def parse_cli_args():
+    parser = argparse.ArgumentParser(description="Forum scraper benchmark")
+    add_server_args(parser)
+    parser.add_argument("--cycles", "-c", type=int, default=5, help="Warm cycles after the first sweep.")
+    parser.add_argument("--new-comments", type=int, default=10, help="Staff comments added before each cycle.")
+    parser.add_argument("--new-discussions", type=int, default=1,
+                        help="Staff discussions added before each cycle.")
+    parser.add_argument("--edits", type=int, default=0, help="Recent staff comments edited before each cycle.")
+    parser.add_argument("--deletions", type=int, default=0,
+                        help="Recent staff comments deleted before each cycle.")
+    parser.add_argument("--scheduled", action="store_true",
+                        help="Only poll users the adaptive poll schedule says are due, as check_loop does. "
+                             "Each cycle is treated as check_delay_minutes after the last.")
+    parser.add_argument("--concurrency", type=int, default=4, help="forum_poll_concurrency for the cog.")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show the cog's log output.")
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(args, port):
+    web.run_app(build_standin(args).app(), host='127.0.0.1', port=port, print=None, handle_signals=False)
+
+
+def make_bot(concurrency, verbose):
+    logger = logging.getLogger("clippy.benchmark")
+    logging.basicConfig(level=logging.INFO if verbose else logging.ERROR)
+    return SimpleNamespace(config={'forum_poll_concurrency': concurrency}, logger=logger, help_logger=logger,
+                           session=None, check_delay_minutes=5, guild_dict={})
+
+
+async def control(session, base, path, method='get', **params):
+    async with session.request(method, f"{base}/_standin/{path}", params=params) as resp:
+        return await resp.json()
+
+
+async def wait_for_server(session, base):
+    for __ in range(100):
+        try:
+            return await control(session, base, 'stats')
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Forum stand-in did not start")
+
+
+async def run_cycle(cog, session, base, poll_all):
+    await control(session, base, 'stats/reset', method='post')
+    wall, cpu = time.perf_counter(), time.process_time()
+    messages = await cog.check_for_updates(poll_all=poll_all)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    stats = await control(session, base, 'stats')
+    return {"requests": stats["requests"], "not_modified": stats["not_modified"], "errors": stats["errors"],
+            "messages": sum(len(items) for items in messages.values()),
+            "wall": wall, "cpu": cpu, "endpoints": stats["endpoints"]}
+
+
+def advance_schedule(cog, seconds):
+    """Moves the poll schedule back as if seconds had passed since the last cycle"""
+    for entry in cog.poll_schedule._state.values():
+        entry["next_poll"] -= seconds
+        entry["last_polled"] -= seconds
+
+
+def report(name, result):
+    print(f"{name:<8} {result['requests']:9d} {result['not_modified']:6d} {result['errors']:6d} "
+          f"{result['messages']:9d} {result['wall']:9.3f} {result['cpu']:9.3f}")
+
+
+async def benchmark(args, base):
+    # imported here so the cog and its database are set up inside the temporary directory
+    from clippy.exts.db.clippy_db import ClippyDB
+    from clippy.exts.commentscrape import CommentScrapeCog
+
+    ClippyDB.start(os.path.join('data', 'clippy.db'))
+    bot = make_bot(args.concurrency, args.verbose)
+    async with aiohttp.ClientSession() as session:
+        await wait_for_server(session, base)
+        bot.session = aiohttp.ClientSession()
+        cog = CommentScrapeCog(bot)
+        cog.forum.base_url = f"{base}/api/v2"
+        print(f"{'cycle':<8} {'requests':>9} {'304s':>6} {'errors':>6} {'messages':>9} {'wall s':>9} {'cpu s':>9}")
+        cold = await run_cycle(cog, session, base, poll_all=True)
+        report("cold", cold)
+        warm = []
+        for cycle in range(1, args.cycles + 1):
+            advance_schedule(cog, bot.check_delay_minutes * 60)
+            await control(session, base, 'activity', method='post',
+                          comments=args.new_comments, discussions=args.new_discussions)
+            if args.edits or args.deletions:
+                await control(session, base, 'edits', method='post', edits=args.edits, deletions=args.deletions)
+            result = await run_cycle(cog, session, base, poll_all=not args.scheduled)
+            report(str(cycle), result)
+            warm.append(result)
+        await bot.session.close()
+    if warm:
+        print()
+        print(f"warm mean: {sum(r['requests'] for r in warm) / len(warm):.1f} requests/cycle, "
+              f"{sum(r['wall'] for r in warm) / len(warm):.3f} s wall, "
+              f"{sum(r['cpu'] for r in warm) / len(warm):.3f} s cpu")
+        endpoints = {}
+        for result in warm:
+            for endpoint, count in result["endpoints"].items():
+                endpoints[endpoint] = endpoints.get(endpoint, 0) + count
+        print("warm requests by endpoint: " + json.dumps(endpoints, sort_keys=True))
+    print(f"forum cache: {cog.forum.cache.stats()}")
+    ClippyDB.stop()
+
+
+def main():
+    args = parse_cli_args()
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(args, port), daemon=True)
+    server.start()
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            os.makedirs('data')
+            asyncio.get_event_loop().run_until_complete(benchmark(args, f"http://127.0.0.1:{port}"))
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -70,7 +70,10 @@ async def maint_start(bot):
         comments_scrape_cog = bot.get_cog("CommentScrapeCog")
         perms_timer_cog = bot.get_cog("PermsTimerCog")
         bot.tasks.append(event_loop.create_task(comments_scrape_cog.check_loop()))
+        bot.tasks.append(event_loop.create_task(comments_scrape_cog.reaction_snapshot_loop()))
         bot.tasks.append(event_loop.create_task(perms_timer_cog.check_loop()))
+        word_counter_cog = bot.get_cog("WordCounter")
+        bot.tasks.append(event_loop.create_task(word_counter_cog.flush_loop()))
         throne_game_cog = bot.get_cog("ThroneGame")
         throne_game_cog.start_loop()
         logger.info('Maintenance Tasks Started')
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections import Counter
+
+import discord
+
+from clippy.exts.db.clippy_db import BackfillJobTable, ClippyDB
+
+DONE = -1
+
+
+def _snowflake_seconds(snowflake):
+    return ((snowflake >> 22) + discord.utils.DISCORD_EPOCH) / 1000
+
+
+class HistoryBackfill:
+    """ Counts a guild's past messages for the word and react counters added since they were sent.
+    A job covers the guild's counters that record when they were created and
+    haven't been backfilled yet; counters added while it runs wait for the
+    next one. Channel histories are read oldest first, one channel at a time,
+    and each batch of messages goes through WordCounter's live matcher. A
+    batch's word counts are flushed in the same transaction as the channel's
+    checkpoint in BackfillJobTable, so an interrupted job resumes after its
+    last batch without counting anything twice. React counts live in
+    react_counts.json and are saved right after each batch commits.
+    Between batches the job sleeps for pause_seconds, so live commands get a
+    share of the REST rate limit, and report is awaited with a progress line
+    at most every report_seconds.
+    """
+    def __init__(self, bot, guild, batch_size=100, pause_seconds=1.0, report=None, report_seconds=30):
+        self.bot = bot
+        self.guild = guild
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.report = report
+        self.report_seconds = report_seconds
+        self.word_cog = bot.cogs.get('WordCounter')
+        self.react_cog = bot.cogs.get('ReactCounter')
+        self.scanned = 0
+        self.word_hits = 0
+        self.react_hits = 0
+        self._last_report = 0
+
+    def _pending_counters(self):
+        words, reacts = {}, {}
+        for key, counter in self.word_cog.counts.items():
+            if counter["guild_id"] == self.guild.id and counter.get("created") and not counter.get("backfilled"):
+                words[key] = counter["created"]
+        if self.react_cog is not None:
+            for emoji_id, counter in self.react_cog.counts.items():
+                if counter.get("guild_id") == self.guild.id and counter.get("created") \
+                        and not counter.get("backfilled"):
+                    reacts[emoji_id] = counter["created"]
+        return words, reacts
+
+    def _channels(self, counters):
+        channel_ids = []
+        for counter in counters:
+            channel_ids += counter["channel_ids"] or [channel.id for channel in self.guild.text_channels]
+        return list(dict.fromkeys(channel_ids))
+
+    def job(self):
+        """Returns the guild's job in progress, or starts one; None if no counter needs a backfill"""
+        job = BackfillJobTable.get_or_none(BackfillJobTable.guildid == self.guild.id)
+        if job is not None:
+            return job
+        words, reacts = self._pending_counters()
+        if not words and not reacts:
+            return None
+        counters = [self.word_cog.counts[key] for key in words] + [self.react_cog.counts[key] for key in reacts]
+        return BackfillJobTable.create(guildid=self.guild.id, before=max([*words.values(), *reacts.values()]),
+                                       counters={"words": words, "reacts": reacts},
+                                       progress={str(channel_id): 0 for channel_id in self._channels(counters)})
+
+    async def run(self):
+        job = self.job()
+        if job is None:
+            return None
+        words = {key: created for key, created in job.counters["words"].items() if key in self.word_cog.counts}
+        reacts = {}
+        if self.react_cog is not None:
+            reacts = {key: created for key, created in job.counters["reacts"].items()
+                      if key in self.react_cog.counts}
+        progress = dict(job.progress)
+        for channel_id, last_id in progress.items():
+            if last_id == DONE:
+                continue
+            channel = self.guild.get_channel(int(channel_id))
+            if channel is not None:
+                try:
+                    await self._backfill_channel(job, progress, channel, last_id, words, reacts)
+                except discord.Forbidden:
+                    self.bot.logger.warning(f"Backfill skipped #{channel.name}, no access to its history")
+            progress[channel_id] = DONE
+            self._checkpoint(job, progress)
+        for key in words:
+            self.word_cog.counts[key]["backfilled"] = True
+        for key in reacts:
+            self.react_cog.counts[key]["backfilled"] = True
+        self.word_cog.save_word_counts()
+        if self.react_cog is not None:
+            self.react_cog.save_react_counts()
+        job.delete_instance()
+        await self._report(force=True)
+        return job
+
+    async def _backfill_channel(self, job, progress, channel, last_id, words, reacts):
+        # history() with before= keeps paging to the newest message, so stop at the cutoff instead
+        cutoff = (job.before * 1000 - discord.utils.DISCORD_EPOCH) << 22
+        after = discord.Object(id=last_id) if last_id else None
+        batch = []
+        async for message in channel.history(limit=None, after=after, oldest_first=True):
+            if message.id >= cutoff:
+                break
+            batch.append(message)
+            if len(batch) >= self.batch_size:
+                await self._count_batch(job, progress, channel, batch, words, reacts)
+                batch = []
+                await self._report()
+                await asyncio.sleep(self.pause_seconds)
+        if batch:
+            await self._count_batch(job, progress, channel, batch, words, reacts)
+
+    async def _count_batch(self, job, progress, channel, batch, words, reacts):
+        word_counts, react_counts = Counter(), Counter()
+        for message in batch:
+            sent = _snowflake_seconds(message.id)
+            for key in self.word_cog.counted_words(message):
+                if words.get(key, 0) > sent:
+                    word_counts[(self.word_cog.counts[key]["counted_word"], message.author.id)] += 1
+            for emoji_id, created in reacts.items():
+                if created > sent and message.reactions:
+                    react_counts[emoji_id] += await self.react_cog.past_reaction_count(message, emoji_id)
+        # nothing may await between these increments and the checkpoint, or flush_loop could
+        # write them (or a cancel could stop the job) without the batch being marked done
+        for (word, user_id), count in word_counts.items():
+            self.word_cog.word_counts.increment(self.guild.id, word, user_id, count)
+            self.word_hits += count
+        progress[str(channel.id)] = batch[-1].id
+        with ClippyDB._db.atomic():
+            self.word_cog.word_counts.flush()
+            self._checkpoint(job, progress)
+        for emoji_id, count in react_counts.items():
+            self.react_cog.counts[emoji_id]["count"] += count
+            self.react_hits += count
+        if react_counts:
+            self.react_cog.save_react_counts()
+        self.scanned += len(batch)
+
+    @staticmethod
+    def _checkpoint(job, progress):
+        BackfillJobTable.update(progress=progress).where(BackfillJobTable.id == job.id).execute()
+
+    def status(self, job):
+        done = sum(1 for last_id in job.progress.values() if last_id == DONE)
+        return (f"Backfill: {self.scanned} messages read, {self.word_hits} words and {self.react_hits} reactions "
+                f"counted, {done}/{len(job.progress)} channels done")
+
+    async def _report(self, force=False):
+        if self.report is None or (not force and time.time() - self._last_report < self.report_seconds):
+            return
+        self._last_report = time.time()
+        job = BackfillJobTable.get_or_none(BackfillJobTable.guildid == self.guild.id)
+        if job is None:
+            text = (f"Backfill finished: {self.scanned} messages read, {self.word_hits} words and "
+                    f"{self.react_hits} reactions counted.")
+        else:
+            text = self.status(job)
+        try:
+            await self.report(text)
+        except discord.HTTPException:
+            pass
@@ -0,0 +1,79 @@
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value, now=None):
+    """Returns the seconds to wait from a Retry-After header (seconds or an HTTP date), or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    now = datetime.fromtimestamp(now or time.time(), timezone.utc)
+    return max((moment - now).total_seconds(), 0.0)
+
+
+class CircuitBreaker:
+    """ Tracks the health of one forum endpoint.
+    After failure_threshold consecutive failures the circuit opens and calls
+    are refused for reset_seconds; a 429 with Retry-After opens it for as long
+    as the forum asks. Once that passes a single half-open probe is let
+    through: success closes the circuit, failure reopens it for twice as long,
+    up to max_reset_seconds.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_seconds=30, max_reset_seconds=600):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_reset_seconds = max_reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._open_for = reset_seconds
+        self._open_until = 0
+
+    def allow(self, now=None):
+        """Returns True if a call may go ahead; in the open state this claims the half-open probe"""
+        if self.state == self.CLOSED:
+            return True
+        now = now or time.time()
+        if now >= self._open_until:
+            # if a probe never reports back, another is let through after the same wait
+            self.state = self.HALF_OPEN
+            self._open_until = now + self._open_for
+            return True
+        return False
+
+    def retry_in(self, now=None):
+        if self.state == self.CLOSED:
+            return 0
+        return max(self._open_until - (now or time.time()), 0)
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._open_for = self.reset_seconds
+
+    def record_failure(self, retry_after=None, now=None):
+        now = now or time.time()
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self._open(min(self._open_for * 2, self.max_reset_seconds), retry_after, now)
+        elif retry_after is not None or self.failures >= self.failure_threshold:
+            self._open(self._open_for, retry_after, now)
+
+    def _open(self, duration, retry_after, now):
+        self._open_for = duration
+        self.state = self.OPEN
+        self.opened += 1
+        self._open_until = now + max(duration if retry_after is None else retry_after, 0)
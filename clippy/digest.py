@@ -0,0 +1,79 @@
+import time
+from datetime import datetime
+
+import discord
+from peewee import chunked
+
+from clippy.exts.db.clippy_db import ClippyDB, DigestItemTable
+
+MODES = {"realtime": None, "hourly": 3600, "daily": 86400}
+
+
+class DigestBuffer:
+    """ Forum notification embeds queued per guild for hourly or daily digests.
+    Items are kept in DigestItemTable so a restart doesn't lose them. A guild's
+    digest is due once its oldest item is from an earlier hour (or day, UTC)
+    than now, so digests go out on the first check after the hour turns.
+    """
+    @staticmethod
+    def add(guild_ids, embeds, now=None):
+        if not guild_ids or not embeds:
+            return
+        now = int(now or time.time())
+        items = [embed.to_dict() for embed in embeds]
+        rows = [{"guildid": guild_id, "dateadded": now, "embed": item} for guild_id in guild_ids for item in items]
+        with ClippyDB._db.atomic():
+            for batch in chunked(rows, 100):
+                DigestItemTable.insert_many(batch).execute()
+
+    @staticmethod
+    def due(guild_id, mode, now=None):
+        """ Returns (row IDs, embeds) of the guild's queued items, oldest first, if its digest
+        is due, otherwise ([], []). Everything queued is due for a guild in realtime mode.
+        """
+        period = MODES.get(mode)
+        now = now or time.time()
+        query = DigestItemTable.select().where(DigestItemTable.guildid == guild_id).order_by(DigestItemTable.id)
+        oldest = query.limit(1).first()
+        if oldest is None:
+            return [], []
+        if period is not None and oldest.dateadded // period >= now // period:
+            return [], []
+        rows = list(query)
+        return [row.id for row in rows], [discord.Embed.from_dict(row.embed) for row in rows]
+
+    @staticmethod
+    def clear(guild_id, last_id):
+        """Drops the guild's items up to last_id, once their digest has been sent"""
+        return DigestItemTable.delete().where((DigestItemTable.guildid == guild_id)
+                                              & (DigestItemTable.id <= last_id)).execute()
+
+    @staticmethod
+    def pending(guild_id):
+        return DigestItemTable.select().where(DigestItemTable.guildid == guild_id).count()
+
+
+def digest_embeds(embeds, mode, max_fields=25, max_characters=5000):
+    """ Groups notification embeds into a few digest embeds, one field per notification, in order.
+    The first embed is headed with the period and how many items it covers.
+    """
+    digests = []
+    digest, characters = None, 0
+    for embed in embeds:
+        name = (embed.title or "Forum update")[:256]
+        description = embed.description or ""
+        if len(description) > 100:
+            description = description[:100] + "..."
+        value = f"[View on the forum]({embed.url})\n{description}" if embed.url else description
+        value = value[:1024] or "\u200b"
+        if digest is None or len(digest.fields) >= max_fields or characters + len(name) + len(value) > max_characters:
+            digest = discord.Embed(colour=embed.colour)
+            digests.append(digest)
+            characters = 0
+        digest.add_field(name=name, value=value, inline=False)
+        characters += len(name) + len(value)
+    if digests:
+        period = "hour" if mode == "hourly" else "day"
+        digests[0].title = f"Forum staff activity from the past {period}: {len(embeds)} updates"
+        digests[-1].set_footer(text=f"Digest sent {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC")
+    return digests
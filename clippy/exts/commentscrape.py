@@ -1,38 +1,72 @@
 import asyncio
+import heapq
+import math
 import os
-import json
+import time
 
 import discord
-import requests
-from bs4 import BeautifulSoup
 from datetime import datetime
 from datetime import date
 
 from discord.ext import commands
 
-from clippy import checks, utils
+from clippy import checks, forumchanges, forumsearch, utils
+from clippy.digest import DigestBuffer, MODES as DIGEST_MODES, digest_embeds
+from clippy.fanout import EmbedFanout
+from clippy.forumalias import AliasResolver
+from clippy.forumcache import ForumCache
+from clippy.forumclient import CircuitOpenError, ForumClient, ForumRequestError
+from clippy.forumhtml import TextCache
+from clippy.forumprofile import IdLog, scrape_profile
+from clippy.forumroster import StaffRoster
+from clippy.pollscheduler import PollScheduler
+from clippy.reactionhistory import ReactionHistory
+from clippy.poststore import CommentStore, PostStore, StaffStore, flush_stores
 
 
 class CommentScrapeCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.users = self._load_file(os.path.join('data', "nia_users.json"))
-        self.post_info = self._load_file(os.path.join('data', "post_info.json"))
-        if not self.users or not self.post_info:
-            return
-        self.post_ids = [p["discussionID"] for p in self.post_info]
+        self.wayforum_ep = "https://community.wayfarer.nianticlabs.com/api/v2" # API endpoint
+        self.forum = ForumClient(bot, self.wayforum_ep,
+                                 timeout=bot.config.get('forum_timeout_seconds', 15),
+                                 retries=bot.config.get('forum_retries', 3),
+                                 per_host_limit=bot.config.get('forum_connections_per_host', 6),
+                                 breaker_failures=bot.config.get('forum_breaker_failures', 5),
+                                 breaker_reset_seconds=bot.config.get('forum_breaker_reset_seconds', 30),
+                                 breaker_max_reset_seconds=bot.config.get('forum_breaker_max_reset_seconds', 600),
+                                 cache=ForumCache(os.path.join('data', 'forum_cache'),
+                                                  max_memory_bytes=bot.config.get('forum_cache_memory_bytes',
+                                                                                  8 * 1024 * 1024)))
+        self.aliases = AliasResolver(self.forum, negative_ttl=bot.config.get('forum_alias_negative_ttl', 3600))
+        self.aliases.import_json('ID_alias_list.json')
+        self.staff = StaffStore()
+        self.staff.import_json(os.path.join('data', "nia_users.json"))
+        self.users = self.staff.users
+        self.posts = PostStore()
+        staff_names = {user_id: user["name"] for user_id, user in self.users.items()}
+        self.posts.import_json(os.path.join('data', "post_info.json"), staff_names)
+        self.posts.assign_authors(staff_names)
+        self.comments = CommentStore()
+        forumsearch.rebuild_index()
+        self.scraped_comment_ids = IdLog(os.path.join('data', 'comment_id_history'))
+        self.scraped_post_ids = IdLog(os.path.join('data', 'post_id_history'))
+        self.roster = StaffRoster(self.forum.get_all, bot.logger,
+                                  ttl=bot.config.get('forum_roster_ttl_seconds', 300))
+        self.discussion_pages = {}
+        self.reaction_history = ReactionHistory(self.forum,
+                                                concurrency=bot.config.get('forum_reaction_fetch_concurrency', 4))
+        self.fanout = EmbedFanout(bot, concurrency=bot.config.get('forum_fanout_concurrency', 5))
+        self.digests = DigestBuffer()
+        self.poll_schedule = PollScheduler(
+            bot.config.get('forum_poll_min_minutes', bot.check_delay_minutes) * 60,
+            bot.config.get('forum_poll_max_minutes', 240) * 60)
+        self.edit_window_pages = bot.config.get('forum_edit_window_pages', 2)
         self.characterLimit = 280
+        self.body_texts = TextCache()
         self.profileIconURL = "https://us.v-cdn.net/6032079/uploads/userpics/801/pQAD25QEXJZ5H.png"
         self.status_tiers = [8,48] # max hours for "active" status, max hours before "offline" status
         self.status_indicators = ["🟢", "🟡", "🔴"] # emoji for online status; active, away, offline
-        self.wayforum_ep = "https://community.wayfarer.nianticlabs.com/api/v2" # API endpoint
-
-    def _load_file(self, filename):
-        if not os.path.exists(filename):
-            self.bot.logger.warn(f'{filename} not found')
-            return None
-        with open(filename, 'r') as json_data:
-            return json.load(json_data)
 
     @commands.command(hidden=True, aliases=['scoc'])
     @commands.has_permissions(manage_roles=True)
@@ -58,6 +92,25 @@ class CommentScrapeCog(commands.Cog):
         await ctx.channel.send(f'{output_channel.mention} set as post output channel.', delete_after=10)
         return await ctx.message.add_reaction(self.bot.success_react)
 
+    @commands.command(hidden=True, aliases=['scow'])
+    @commands.has_permissions(manage_roles=True)
+    async def set_comment_output_webhook(self, ctx, url):
+        """ Sends staff post notifications through a webhook instead of the comment output channel.
+        Use 'none' to go back to the channel."""
+        try:
+            await ctx.message.delete()
+        except discord.Forbidden:
+            self.bot.logger.warn(f"Did not have permission to delete message in {ctx.channel.name}.")
+        configure_dict = self.bot.guild_dict[ctx.guild.id]['configure_dict']
+        if url.lower() == "none":
+            configure_dict.pop('comment_output_webhook', None)
+            return await ctx.channel.send('Comment output webhook removed.', delete_after=10)
+        if not url.startswith("https://discord.com/api/webhooks/") \
+                and not url.startswith("https://discordapp.com/api/webhooks/"):
+            return await ctx.channel.send('That does not look like a Discord webhook URL.', delete_after=10)
+        configure_dict['comment_output_webhook'] = url
+        return await ctx.channel.send('Comment output webhook set.', delete_after=10)
+
     async def channel_helper(self, ctx, item):
         utilities_cog = self.bot.cogs.get('Utilities')
         if not utilities_cog:
@@ -94,7 +147,7 @@ class CommentScrapeCog(commands.Cog):
     @commands.command(hidden=True, aliases=['ttt'])
     @commands.has_permissions(manage_roles=True)
     async def test_test(self, ctx):
-        await self.check_for_updates(ctx.guild.id)
+        await self.check_for_updates(poll_all=True)
 
     @commands.command(hidden=True, name='get_comment_reactions', aliases=['gcr'])
     @checks.allow_react_check_commands()
@@ -107,20 +160,57 @@ class CommentScrapeCog(commands.Cog):
         return await self._check_reaction_command_perms(ctx, comment_id, "discussion")
 
     async def _check_reaction_command_perms(self, ctx, comment_id, command_type):
+        if not await self._reaction_command_allowed(ctx, f"_get_{command_type}_reactions"):
+            return
+        return await self._get_reactions(ctx, comment_id, command_type)
+
+    async def _reaction_command_allowed(self, ctx, command_name):
         allowed_roles = [639828284703506448, 702291832041767025]
         allowed = False
         for role in ctx.message.author.roles:
             if role.id in allowed_roles:
                 allowed = True
         if not allowed:
-            self.bot.logger.info(f"{ctx.message.author.name} used command _get_{command_type}_reactions "
+            self.bot.logger.info(f"{ctx.message.author.name} used command {command_name} "
                                  f"in channel {ctx.channel.name}")
             try:
-                return await ctx.message.delete()
+                await ctx.message.delete()
             except discord.Forbidden:
                 self.bot.logger.warn(f"Did not have permission to delete message in {ctx.channel.name}.")
-                return
-        return await self._get_reactions(ctx, comment_id, command_type)
+        return allowed
+
+    @commands.command(hidden=True, name='reaction_history', aliases=['rh'])
+    @checks.allow_react_check_commands()
+    async def _reaction_history(self, ctx, command_type_singular, comment_id: int):
+        """ Shows how a watched comment's or discussion's reaction counts changed over time.
+        e.g. !reaction_history comment 12343
+        Posts are watched for a while after !gcr or !gdr is used on them."""
+        if not await self._reaction_command_allowed(ctx, "reaction_history"):
+            return
+        command_type_singular = command_type_singular.lower().rstrip('s')
+        if command_type_singular not in ("comment", "discussion"):
+            error_response = await ctx.send("Please say whether it's a comment or a discussion, "
+                                            "e.g. !reaction_history comment 12343")
+            return await self._cleanup(ctx.message, error_response)
+        snapshots = self.reaction_history.history(command_type_singular, comment_id)
+        if not snapshots:
+            error_response = await ctx.send(f"No reaction history for {command_type_singular} {comment_id} yet. "
+                                            f"Use !gcr or !gdr on it to start watching it.")
+            return await self._cleanup(ctx.message, error_response)
+        lines = []
+        previous = {}
+        for taken, totals in snapshots:
+            counts = []
+            for react_type in sorted(set(totals) | set(previous)):
+                change = totals.get(react_type, 0) - previous.get(react_type, 0)
+                counts.append(f"{react_type} **{totals.get(react_type, 0)}**" + (f" ({change:+})" if change else ""))
+            lines.append(f"`{datetime.utcfromtimestamp(taken).strftime('%Y-%m-%d %H:%M')}` " + ", ".join(counts))
+            previous = totals
+        response_embed = discord.Embed(colour=discord.Colour.from_rgb(252, 71, 19))
+        response_embed.title = f"Reaction history for {command_type_singular.capitalize()} *{comment_id}*"
+        response_embed.description = "\n".join(lines[-15:])[-2048:]
+        response_embed.set_footer(text="Times are UTC")
+        await ctx.send(embed=response_embed)
 
     @checks.serverowner_or_permissions(manage_messages=True)
     @commands.command(hidden=True, name='score_counts', aliases=['sc'])
@@ -131,26 +221,22 @@ class CommentScrapeCog(commands.Cog):
             self.bot.logger.warn(f"Did not have permission to delete message in {ctx.channel.name}.")
         async with ctx.typing():
             limit = min(limit, 25)
-            page = 1
             all_reactions = {}
-            comment_list = []
             all_comments = {}
-            while True:
-                url = f"https://community.wayfarer.nianticlabs.com/api/v2/comments?discussionID={post_id}&limit=100&page={page}"
-                response = requests.get(url)
-                if response.status_code != 200:
-                    error_response = await ctx.send(f"Failed to look up comments for post {post_id}")
-                    return await self._cleanup(ctx.message, error_response)
-                comments = response.json()
-                if len(comments) == 0:
-                    break
-                comment_list += comments
-                page += 1
+            try:
+                comment_list = await self._get_discussion_comments(post_id)
+            except CircuitOpenError as e:
+                error_response = await ctx.send(f"The forum isn't responding right now, please try again in "
+                                                f"{int(e.retry_in) + 1} seconds.")
+                return await self._cleanup(ctx.message, error_response)
+            except ForumRequestError:
+                error_response = await ctx.send(f"Failed to look up comments for post {post_id}")
+                return await self._cleanup(ctx.message, error_response)
             for comment in comment_list:
                 if comment["score"]:
                     all_comments[comment["commentID"]] = comment
                     all_reactions[comment["commentID"]] = comment["score"]
-            sort_orders = sorted(all_reactions.items(), key=lambda x: x[1], reverse=True)
+            sort_orders = heapq.nlargest(limit, all_reactions.items(), key=lambda x: x[1])
             # likes_only = {}
             # for i in sort_orders[:30]:
             #     c_reactions = await self._get_reactions(ctx, i[0], "comment", False)
@@ -165,7 +251,7 @@ class CommentScrapeCog(commands.Cog):
             for i in sort_orders[:limit]:
                 com = all_comments[i[0]]
                 raw = com['body']
-                clean_text = BeautifulSoup(raw, 'html.parser').get_text()
+                clean_text = self.body_texts.text(("comment", i[0]), raw, 100)
                 response_embed.add_field(name=f"**{rank}**. Score: {i[1]}",
                                          value=f"\n [{clean_text[:100]}](https://community.wayfarer.nianticlabs.com/discussion/comment/{i[0]}/#Comment_{i[0]})")
                 rank += 1
@@ -176,39 +262,77 @@ class CommentScrapeCog(commands.Cog):
                 response_embed.url = f"https://community.wayfarer.nianticlabs.com/discussion/{post_id}"
             await ctx.send(embed=response_embed)
 
+    async def _get_discussion_comments(self, post_id, page_size=100):
+        """ Returns every comment in a discussion.
+        The page count is estimated from the discussion's comment count and the pages
+        are fetched concurrently. Pages are kept per discussion: within
+        score_counts_cache_minutes only the last known page onwards is fetched again,
+        after that everything is refreshed so scores stay current.
+        """
+        post_id = int(post_id)
+        discussion = await self.forum.get_json(f"discussions/{post_id}", ttl=60)
+        page_count = max(math.ceil(discussion.get("countComments", 0) / page_size), 1)
+        cached = self.discussion_pages.get(post_id)
+        max_age = self.bot.config.get('score_counts_cache_minutes', 10) * 60
+        if cached and time.time() - cached["fetched"] < max_age:
+            pages = cached["pages"]
+            first_page = max(pages.keys(), default=1)
+        else:
+            pages = {}
+            first_page = 1
+            cached = {"fetched": time.time(), "pages": pages}
+        page_numbers = list(range(first_page, max(page_count, first_page) + 1))
+        results = await asyncio.gather(*[self.forum.get_json(
+            "comments", params={"discussionID": post_id, "limit": page_size, "page": page})
+            for page in page_numbers])
+        for page, comments in zip(page_numbers, results):
+            pages[page] = comments
+        # the comment count can lag behind, so keep going while the last page is full
+        page = page_numbers[-1]
+        if len(pages[page]) >= page_size:
+            async for page, comments in self.forum.iter_pages(
+                    "comments", {"discussionID": post_id, "limit": page_size}, start_page=page + 1):
+                pages[page] = comments
+        for stale_page in [p for p in pages if p > page]:
+            del pages[stale_page]
+        self.discussion_pages[post_id] = cached
+        while len(self.discussion_pages) > 16:
+            oldest = min(self.discussion_pages, key=lambda d: self.discussion_pages[d]["fetched"])
+            del self.discussion_pages[oldest]
+        return [comment for page in sorted(pages) for comment in pages[page]]
+
     async def _get_reactions(self, ctx, comment_id, command_type_singular, send=True):
         try:
             comment_id = int(comment_id)
         except ValueError:
             comment_id = int(comment_id.strip('<>').split("_")[-1])
-        command_type = command_type_singular + "s"
-        page = 1
         # 12343 error403
-        full_reactions = {}
-        while True:
-            response = requests.get("https://community.wayfarer.nianticlabs.com/api/v2/"
-                                    f"{command_type}/{comment_id}/reactions?limit=100&page={page}")
-            if response.status_code != 200:
-                error_response = await ctx.send(f"No {command_type_singular} found with id: {comment_id}")
+        try:
+            # only the pages after the reactions already stored are fetched
+            all_reactions = await self.reaction_history.fetch(command_type_singular, comment_id)
+            self.reaction_history.watch(command_type_singular, comment_id,
+                                        self.bot.config.get('forum_reaction_watch_days', 7) * 86400)
+        except CircuitOpenError as e:
+            error_response = await ctx.send(f"The forum isn't responding right now, please try again in "
+                                            f"{int(e.retry_in) + 1} seconds.")
+            return await self._cleanup(ctx.message, error_response)
+        except ForumRequestError:
+            error_response = await ctx.send(f"No {command_type_singular} found with id: {comment_id}")
+            return await self._cleanup(ctx.message, error_response)
+        if not all_reactions:
+            if send:
+                error_response = await ctx.send(f"{command_type_singular} {comment_id} has no reactions")
                 return await self._cleanup(ctx.message, error_response)
-            reactions = response.json()
-            if len(reactions) == 0:
-                if page == 1:
-                    if send:
-                        error_response = await ctx.send(f"{command_type_singular} {comment_id} has no reactions")
-                        return await self._cleanup(ctx.message, error_response)
-                    else:
-                        return
-                if not send:
-                    return full_reactions
-                return
+            return
+        message_reactions = self._tally_reactions(all_reactions, {})
+        if not send:
+            return message_reactions
+        pages = self._reaction_pages(message_reactions)
 
-            if send:
-                response_embed = await self._create_reactions_embed(reactions, command_type_singular, comment_id)
-                await ctx.send(embed=response_embed)
-            else:
-                full_reactions = self._tally_reactions(reactions, full_reactions)
-            page += 1
+        def render(page_number):
+            return self._create_reactions_embed(message_reactions, pages, page_number,
+                                                command_type_singular, comment_id)
+        await self._send_paginated(ctx, render, len(pages))
 
     @staticmethod
     def _tally_reactions(reactions, message_reactions):
@@ -220,13 +344,23 @@ class CommentScrapeCog(commands.Cog):
         return message_reactions
 
     @staticmethod
-    async def _create_reactions_embed(reactions, command_type_singular, comment_id):
-        message_reactions = {}
-        for react in reactions:
-            react_type = react["reactionType"]["name"]
-            if react_type not in message_reactions:
-                message_reactions[react_type] = []
-            message_reactions[react_type].append(react["user"]["name"])
+    def _reaction_pages(message_reactions, page_characters=1800):
+        """ Splits tallied reactions into pages: a summary, then each reaction type's
+        names in runs that fit an embed. Pages are (reaction type, first name, last name)
+        and only rendered when shown."""
+        pages = [(None, 0, 0)]
+        for react_type, names in sorted(message_reactions.items(), key=lambda item: -len(item[1])):
+            first, characters = 0, 0
+            for index, name in enumerate(names):
+                if characters + len(name) + 2 > page_characters and index > first:
+                    pages.append((react_type, first, index))
+                    first, characters = index, 0
+                characters += len(name) + 2
+            pages.append((react_type, first, len(names)))
+        return pages
+
+    @staticmethod
+    def _create_reactions_embed(message_reactions, pages, page_number, command_type_singular, comment_id):
         response_embed = discord.Embed(colour=discord.Colour.from_rgb(252, 71, 19))
         if command_type_singular == "discussion":
             title_url = f"https://community.wayfarer.nianticlabs.com/discussion/{comment_id}/"
@@ -235,13 +369,61 @@ class CommentScrapeCog(commands.Cog):
                         f"#Comment_{comment_id}"
         response_embed.url = title_url
         response_embed.title = f"Reactions for {command_type_singular.capitalize()} *{comment_id}*"
-        message_text = ""
-        for react_type in message_reactions:
-            message_text += f"**{react_type}** ({len(message_reactions[react_type])}): " \
-                            f"{', '.join(message_reactions[react_type])}\n"
+        react_type, first, last = pages[page_number]
+        if react_type is None:
+            message_text = ""
+            for summary_type, names in sorted(message_reactions.items(), key=lambda item: -len(item[1])):
+                message_text += f"**{summary_type}** ({len(names)})\n"
+        else:
+            names = message_reactions[react_type]
+            message_text = f"**{react_type}** ({len(names)}): {', '.join(names[first:last])}"
+            if first > 0 or last < len(names):
+                message_text += f"\n\n*{first + 1}-{last} of {len(names)}*"
         response_embed.description = message_text
+        if len(pages) > 1:
+            response_embed.set_footer(text=f"Page {page_number + 1} of {len(pages)}. "
+                                           f"Use the arrows to see who reacted.")
         return response_embed
 
+    async def _send_paginated(self, ctx, render, page_count, timeout=120):
+        """Sends page 0 and lets the command's author flip through the pages with reactions"""
+        message = await ctx.send(embed=render(0))
+        if page_count < 2:
+            return message
+        previous_emoji, next_emoji = '⬅', '➡'
+        for emoji in (previous_emoji, next_emoji):
+            await message.add_reaction(emoji)
+
+        def check(reaction, user):
+            return reaction.message.id == message.id and user.id == ctx.author.id \
+                and str(reaction.emoji) in (previous_emoji, next_emoji)
+
+        # the author's reaction is taken off again after each flip when the bot may do so,
+        # otherwise taking it off counts as a flip as well
+        can_remove = ctx.guild is not None and ctx.channel.permissions_for(ctx.guild.me).manage_messages
+        events = ['reaction_add'] if can_remove else ['reaction_add', 'reaction_remove']
+        page_number = 0
+        while True:
+            waits = [asyncio.ensure_future(self.bot.wait_for(event, check=check)) for event in events]
+            done, pending = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for future in pending:
+                future.cancel()
+            if not done:
+                break
+            reaction, user = done.pop().result()
+            page_number = (page_number + (1 if str(reaction.emoji) == next_emoji else -1)) % page_count
+            await message.edit(embed=render(page_number))
+            if can_remove:
+                try:
+                    await message.remove_reaction(reaction.emoji, user)
+                except discord.HTTPException:
+                    pass
+        try:
+            await message.clear_reactions()
+        except discord.HTTPException:
+            pass
+        return message
+
     @staticmethod
     async def _cleanup(message, error_response):
         await asyncio.sleep(10)
@@ -253,182 +435,261 @@ class CommentScrapeCog(commands.Cog):
 
     async def comment_scrape(self, guild_id):
         task_page = "https://community.wayfarer.nianticlabs.com/profile/comments/NianticCasey-ING"
-        page = requests.get(task_page)
-        soup = BeautifulSoup(page.content, 'html.parser')
-        new_comments = 0
-
-        comments = soup.findAll('li', attrs={'class': 'Item'})
+        comments = await scrape_profile(self.forum, task_page, "comment", [self.scraped_comment_ids])
 
+        output_channel_id = self.bot.guild_dict[guild_id]['configure_dict'].get('comment_output_channel', 0)
+        output_channel = None
+        if output_channel_id != 0:
+            output_channel = self.bot.get_channel(output_channel_id)
         for comment in comments:
-            comment_id = comment.attrs['id'].split('_')[1]
-            if comment_id in self.comment_ids:
-                break
-            raw_message = comment.find('div', attrs={'class': 'Message'})
-            message_text = raw_message.contents[0]
-
-            link_el = comment.find('span', attrs={'class': 'MItem'})
-            post_title = link_el.find('a').contents[0]
-
-            output_channel_id = self.bot.guild_dict[guild_id]['configure_dict'].get('comment_output_channel', 0)
-            output_channel = None
-            if output_channel_id != 0:
-                output_channel = self.bot.get_channel(output_channel_id)
             if output_channel:
-                message_embed = self.format_comment_message(comment_id, post_title, message_text)
+                message_embed = self.format_comment_message(comment["id"], comment.get("title", ""),
+                                                            comment["text"])
                 await output_channel.send(embed=message_embed)
             else:
                 self.bot.logger.warn("No post output channel found.")
-            self.comment_ids.append(comment_id)
-            new_comments += 1
-
-        with open(os.path.join('data', 'comment_id_history'), 'w') as file:
-            for cid in self.comment_ids:
-                file.write("%i\n" % int(cid))
+        self.scraped_comment_ids.extend(comment["id"] for comment in comments)
 
-        return new_comments
+        return len(comments)
 
     async def post_scrape(self, guild_id):
         task_page = "https://community.wayfarer.nianticlabs.com/profile/discussions/NianticCasey-ING"
-        page = requests.get(task_page)
-        soup = BeautifulSoup(page.content, 'html.parser')
-        new_posts = 0
-
-        posts = soup.findAll('li', attrs={'class': 'ItemDiscussion'})
+        posts = await scrape_profile(self.forum, task_page, "discussion",
+                                     [self.posts, self.scraped_post_ids])
 
+        output_channel_id = self.bot.guild_dict[guild_id]['configure_dict'].get('comment_output_channel', 0)
+        output_channel = None
+        if output_channel_id != 0:
+            output_channel = self.bot.get_channel(output_channel_id)
         for post in posts:
-            post_id = post.attrs['id'].split('_')[1]
-            if post_id in self.post_ids:
-                break
-            title_div = post.find('div', attrs={'class': 'Title'})
-            title_a = title_div.find('a')
-            meta_div = post.find('div', attrs={'class': 'Meta'})
-            post_title = title_a.contents[0]
-            post_url = title_a.attrs['href']
-
-            category_span = meta_div.find('span', attrs={'class': 'Category'})
-            category_a = category_span.find('a')
-            category_name = category_a.contents[0]
-
-            output_channel_id = self.bot.guild_dict[guild_id]['configure_dict'].get('comment_output_channel', 0)
-            output_channel = None
-            if output_channel_id != 0:
-                output_channel = self.bot.get_channel(output_channel_id)
             if output_channel:
-                message_embed = self.format_post_message(post_title, post_url, category_name)
+                message_embed = self.format_post_message(post.get("title", ""), post.get("url"),
+                                                         post.get("category", ""))
                 await output_channel.send(embed=message_embed)
             else:
                 self.bot.logger.warn("No post output channel found.")
-            self.post_ids.append(post_id)
-            new_posts += 1
+        self.scraped_post_ids.extend(post["id"] for post in posts)
 
-        with open(os.path.join('data', 'post_id_history'), 'w') as file:
-            for cid in self.post_ids:
-                file.write("%i\n" % int(cid))
+        return len(posts)
 
-        return new_posts
-
-    async def check_for_updates(self):
-        messages = {"comments": [], "discussions": []}
+    async def check_for_updates(self, poll_all=False):
+        messages = {"comments": [], "discussions": [], "edits": []}
 
         await self._check_for_user_changes()
-        for user_id, user in self.users.items():
-            comments_page, discussions_page = user["last_comments_page"], user["last_discussions_page"]
-            latest_comment, latest_discussion = user["latest_comment"], user["latest_discussion"]
-            last_page = []
+        if not self.forum.available("comments") or not self.forum.available("discussions"):
+            # users stay due, so they are polled as soon as the forum recovers
+            self.bot.logger.warn("Forum is failing, skipping this update check.")
+            return messages
+        now = time.time()
+        if poll_all:
+            user_ids = list(self.users.keys())
+        else:
+            user_ids = self.poll_schedule.due(self.users.keys(), now)
+        self.bot.logger.info(f"Polling {len(user_ids)} of {len(self.users)} forum users.")
+        cursors = {user_id: (self.users[user_id]["latest_comment"], self.users[user_id]["latest_discussion"])
+                   for user_id in user_ids}
+        # every user's discussion and comment streams are polled concurrently, at most
+        # forum_poll_concurrency at a time. gather keeps results in user order so the
+        # merged output is the same as a serial sweep
+        poll_limit = asyncio.Semaphore(self.bot.config.get('forum_poll_concurrency', 4))
+        polls = []
+        for user_id in user_ids:
+            polls.append(self._poll_user_discussions(user_id, self.users[user_id], poll_limit))
+            polls.append(self._poll_user_comments(user_id, self.users[user_id], poll_limit))
+        results = await asyncio.gather(*polls)
+        polled = []
+        for user_id, (discussion_messages, discussion_edits, discussions_ok), \
+                (comment_messages, comment_edits, comments_ok) in zip(user_ids, results[::2], results[1::2]):
+            messages["discussions"] += discussion_messages
+            messages["comments"] += comment_messages
+            messages["edits"] += discussion_edits + comment_edits
+            if discussions_ok and comments_ok:
+                polled.append(user_id)
+        if not self.forum.available("comments") or not self.forum.available("discussions"):
+            self.bot.logger.warn("Forum started failing during this update check, some users were skipped.")
+        # users whose poll failed weren't checked, so they stay due rather than backing off
+        for user_id in polled:
+            user = self.users[user_id]
+            found_new = cursors[user_id] != (user["latest_comment"], user["latest_discussion"])
+            self.poll_schedule.record_poll(user_id, found_new, now)
+
+        # new comments, discussions and changed staff cursors are written in one transaction
+        try:
+            flush_stores(self.staff, self.posts, self.comments)
+        except Exception as e:
+            self.bot.logger.error(f"Failed to save forum scrape results, will retry next cycle.\nFull error: {e}")
+
+        return messages
 
+    async def _poll_user_discussions(self, user_id, user, poll_limit):
+        """Returns (new discussion embeds, edit embeds, whether the stream was read to the end)"""
+        messages, edits, ok = [], [], False
+        discussions_page, latest_discussion = user["last_discussions_page"], user["latest_discussion"]
+        # the last few pages before the cursor are fetched again to catch edits and deletions;
+        # they are usually unchanged, so the forum cache gets them back as cheap 304s
+        known_discussion = latest_discussion
+        first_page = max(discussions_page - self.edit_window_pages + 1, 1)
+        seen = []
+        async with poll_limit:
             try:
-                while True:
-                    url = f"https://community.wayfarer.nianticlabs.com/api/v2/discussions?insertUserID={user_id}" \
-                          f"&limit=100&page={discussions_page}"
-                    async with self.bot.session.get(url=url) as response:
-                        await response
-                    if response.json() == last_page or response.json() == []:
-                        break
-                    last_page = response.json()
-                    discussions = response.json()
+                pages = self.forum.iter_pages("discussions", {"insertUserID": user_id, "limit": 100},
+                                              start_page=first_page)
+                discussions_page = first_page - 1
+                async for discussions_page, discussions in pages:
                     if len(discussions) > 2:
-                        discussions.reverse()
+                        discussions = discussions[::-1]
                     for discussion in discussions:
-                        if int(discussion["discussionID"]) not in self.post_ids:
-                            self.post_ids.append(discussion["discussionID"])
-                            self.post_info.append(self._compact_discussion(discussion))
+                        if int(discussion["discussionID"]) <= known_discussion:
+                            seen.append(discussion)
+                        # a parent post looked up for a comment may already be stored without its author
+                        if not self.posts.has_author(discussion["discussionID"]):
+                            self.posts.add(self._compact_discussion(discussion), user["name"])
                         if int(discussion["discussionID"]) > latest_discussion:
                             latest_discussion = discussion["discussionID"]
-                            messages["discussions"].append(self._format_discussion(discussion, user["name"]))
-                    discussions_page += 1
+                            messages.append(self._format_discussion(discussion, user["name"]))
+                if self.edit_window_pages:
+                    edits = self._find_edits("discussion", user, seen)
                 user["latest_discussion"] = latest_discussion
-                user["last_discussions_page"] = max(discussions_page - 1, 1)
+                user["last_discussions_page"] = max(discussions_page, 1)
+                ok = True
+            except CircuitOpenError:
+                # the forum started failing mid-sweep, check_for_updates warns once for the cycle
+                pass
             except Exception as e:
                 self.bot.logger.warn(f"Failed to update discussions for user {user['name']}\nFull error: {e}")
-
-            last_page = []
+        return messages, edits, ok
+
+    async def _poll_user_comments(self, user_id, user, poll_limit):
+        """Returns (new comment embeds, edit embeds, whether the stream was read to the end)"""
+        messages, edits, ok = [], [], False
+        comments_page, latest_comment = user["last_comments_page"], user["latest_comment"]
+        known_comment = latest_comment
+        first_page = max(comments_page - self.edit_window_pages + 1, 1)
+        seen = []
+        async with poll_limit:
             try:
-                while True:
-                    url = "https://community.wayfarer.nianticlabs.com/api/v2/comments?insertUserID=" + str(
-                            user_id) + "&limit=100&page=" + str(comments_page)
-                    async with self.bot.session.get(url=url) as response:
-                        await response
-                    if response.json() == last_page or response.json() == []:
-                        break
-                    last_page = response.json()
-                    comments = response.json()
-                    if len(comments) > 0:
-                        for comment in comments:
-                            if comment["commentID"] > latest_comment:
-                                latest_comment = comment["commentID"]
-                                if int(comment["discussionID"]) not in self.post_ids:
-                                    parent_post = self._get_post_by_id(comment["discussionID"])
-                                    self.post_ids.append(parent_post["discussionID"])
-                                    self.post_info.append(parent_post)
-                                else:
-                                    parent_post = self._get_discussion_from_list(self.post_info, comment["discussionID"])
-                                if int(parent_post["categoryID"]) not in user["exclude_categories"]:
-                                    messages["comments"]\
-                                        .append(self._format_comment(comment, parent_post, user["name"]))
-                        comments_page += 1
-                    else:
-                        break
-                    comments_page = max(comments_page, 1)
-                    user["latest_comment"] = latest_comment
-                    user["last_comments_page"] = comments_page - 1
+                pages = self.forum.iter_pages("comments", {"insertUserID": user_id, "limit": 100},
+                                              start_page=first_page)
+                async for comments_page, comments in pages:
+                    for comment in comments:
+                        if comment["commentID"] > latest_comment:
+                            latest_comment = comment["commentID"]
+                            parent_post = await self._get_parent_post(comment["discussionID"])
+                            self.comments.add(comment, user["name"], parent_post["name"])
+                            if int(parent_post["categoryID"]) not in user["exclude_categories"]:
+                                messages.append(self._format_comment(comment, parent_post, user["name"]))
+                        elif comment["commentID"] <= known_comment:
+                            seen.append(comment)
+                    if comments_page >= user["last_comments_page"]:
+                        user["latest_comment"] = latest_comment
+                        user["last_comments_page"] = max(comments_page, 1)
+                if self.edit_window_pages:
+                    edits = self._find_edits("comment", user, seen)
+                ok = True
+            except CircuitOpenError:
+                # the forum started failing mid-sweep, check_for_updates warns once for the cycle
+                pass
             except Exception as e:
                 self.bot.logger.warn(f"Failed to update comments for user {user['name']}\nFull error: {e}")
+        return messages, edits, ok
 
-        with open(os.path.join('data', 'post_info.json'), 'w') as fd:
-            json.dump(self.post_info, fd, indent=4)
-
-        with open(os.path.join('data', 'nia_users.json'), 'w') as fd:
-            json.dump(self.users, fd, indent=4)
-
+    def _find_edits(self, kind, user, items):
+        """ Compares posts fetched again from the edit window with the stored versions.
+        Changed posts are stored again and returned as "edited" embeds, stored posts
+        missing from the window as "deleted" embeds.
+        """
+        if not items:
+            return []
+        if kind == "comment":
+            store, id_key, hash_item = self.comments, "commentID", forumchanges.comment_hash
+        else:
+            store, id_key, hash_item = self.posts, "discussionID", forumchanges.discussion_hash
+        item_ids = [int(item[id_key]) for item in items]
+        stored = store.versions(user["name"], min(item_ids), max(item_ids))
+        edited, updated, deleted = forumchanges.find_changes(items, id_key, hash_item, stored)
+        messages = []
+        for item in edited:
+            if kind == "comment":
+                old_body, old_title = self.comments.text(item[id_key]), None
+            else:
+                old_post = self.posts.get(item[id_key]) or {}
+                old_body, old_title = old_post.get("body"), old_post.get("name")
+            if not self._edit_excluded(kind, item, user):
+                messages.append(self._format_edit(kind, item, user["name"], old_body, old_title))
+        for item in edited + updated:
+            self.body_texts.forget((kind, int(item[id_key])))
+            if kind == "comment":
+                parent_post = self.posts.get(item["discussionID"])
+                self.comments.add(item, user["name"], parent_post["name"] if parent_post else None)
+            else:
+                self.posts.add(self._compact_discussion(item), user["name"])
+        when = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        for item_id in deleted:
+            if kind == "comment":
+                old_body, old_title = self.comments.text(item_id), None
+            else:
+                old_post = self.posts.get(item_id) or {}
+                old_body, old_title = old_post.get("body"), old_post.get("name")
+            store.mark_deleted(item_id, when)
+            if not self._deletion_excluded(kind, item_id, user):
+                messages.append(self._format_deletion(kind, item_id, user["name"], old_body, old_title))
         return messages
 
-    async def _check_for_user_changes(self):
-        role_ids = [16, 32, 33]
-        for role in role_ids:
-            users = requests.get(
-                f"https://community.wayfarer.nianticlabs.com/api/v2/users?roleID={role}&limit=100").json()
-            for user in users:
-                if str(user["userID"]) not in self.users.keys():
-                    self.users[str(user["userID"])] = {
-                        "userID": user["userID"],
-                        "name": user["name"],
-                        "exclude_categories": [],
-                        "last_comments_page": 1,
-                        "last_discussions_page": 1,
-                        "latest_comment": 0,
-                        "latest_discussion": 0
-                    }
-                else:
-                    self.users[str(user["userID"])]["name"] = user["name"]
+    def _edit_excluded(self, kind, item, user):
+        if kind == "comment":
+            category_id = self.posts.category(item["discussionID"])
+        else:
+            category_id = item["categoryID"]
+        return self._category_excluded(category_id, user)
+
+    def _deletion_excluded(self, kind, item_id, user):
+        if kind == "comment":
+            discussion_id = self.comments.discussion_id(item_id)
+            category_id = self.posts.category(discussion_id) if discussion_id is not None else None
+        else:
+            category_id = self.posts.category(item_id)
+        return self._category_excluded(category_id, user)
 
     @staticmethod
-    def _get_discussion_from_list(posts, post_id):
-        for p in posts:
-            if p["discussionID"] == post_id:
-                return p
+    def _category_excluded(category_id, user):
+        return category_id is not None and int(category_id) in user["exclude_categories"]
+
+    async def _get_parent_post(self, discussion_id):
+        parent_post = self.posts.get(discussion_id)
+        if parent_post is not None:
+            return parent_post
+        parent_post = await self._get_post_by_id(discussion_id)
+        # another stream may have stored the post while this one was waiting on the forum
+        if parent_post["discussionID"] not in self.posts:
+            author = self.users.get(str(parent_post["insertUserID"]))
+            self.posts.add(parent_post, author["name"] if author else None)
+        return parent_post
 
-    def _get_post_by_id(self, post_id):
-        full_post = requests.get("https://community.wayfarer.nianticlabs.com/api/v2/discussions/" + str(post_id)).json()
+    async def _check_for_user_changes(self):
+        try:
+            users = await self.roster.get()
+        except ForumRequestError as e:
+            self.bot.logger.warn(f"Failed to look up forum staff roster\nFull error: {e}")
+            return
+        for user in users:
+            if str(user["userID"]) not in self.users.keys():
+                self.users[str(user["userID"])] = {
+                    "userID": user["userID"],
+                    "name": user["name"],
+                    "exclude_categories": [],
+                    "last_comments_page": 1,
+                    "last_discussions_page": 1,
+                    "latest_comment": 0,
+                    "latest_discussion": 0
+                }
+            else:
+                self.users[str(user["userID"])]["name"] = user["name"]
+            if user.get("dateLastActive"):
+                last_active = datetime.strptime(user["dateLastActive"], "%Y-%m-%dT%H:%M:%S%z").timestamp()
+                self.poll_schedule.saw_activity(str(user["userID"]), last_active)
+
+    async def _get_post_by_id(self, post_id):
+        full_post = await self.forum.get_json(f"discussions/{post_id}", ttl=3600)
         return self._compact_discussion(full_post)
 
     @staticmethod
@@ -437,6 +698,7 @@ class CommentScrapeCog(commands.Cog):
                 "name": full_post["name"],
                 "body": full_post["body"],
                 "categoryID": full_post["categoryID"],
+                "dateInserted": full_post.get("dateInserted"),
                 "dateUpdated": full_post["dateUpdated"],
                 "insertUserID": full_post["insertUserID"],
                 "url": full_post["url"]
@@ -444,7 +706,7 @@ class CommentScrapeCog(commands.Cog):
 
     def _format_comment(self, comment, parent, username):
         thread_title = parent["name"]
-        clean_text = BeautifulSoup(comment['body'], 'html.parser').get_text()
+        clean_text = self.body_texts.text(("comment", comment["commentID"]), comment['body'], self.characterLimit)
         if len(clean_text) > self.characterLimit:
             clean_text = clean_text[:self.characterLimit] + "..."
 
@@ -459,7 +721,8 @@ class CommentScrapeCog(commands.Cog):
 
     def _format_discussion(self, discussion, username):
         thread_title = discussion["name"]
-        clean_text = BeautifulSoup(discussion['body'], 'html.parser').get_text()
+        clean_text = self.body_texts.text(("discussion", discussion["discussionID"]), discussion['body'],
+                                          self.characterLimit)
         if len(clean_text) > self.characterLimit:
             clean_text = clean_text[:self.characterLimit] + "..."
 
@@ -471,27 +734,205 @@ class CommentScrapeCog(commands.Cog):
         m_embed.set_thumbnail(url=self.profileIconURL)
         return m_embed
 
+    def format_comment_message(self, comment_id, post_title, message_text):
+        if len(message_text) > self.characterLimit:
+            message_text = message_text[:self.characterLimit] + "..."
+        m_embed = discord.Embed(colour=discord.Colour.from_rgb(252, 71, 19))
+        m_embed.title = f"New comment in:\n {post_title}"
+        m_embed.description = message_text
+        m_embed.url = f"https://community.wayfarer.nianticlabs.com/discussion/comment/{comment_id}#Comment_{comment_id}"
+        m_embed.set_thumbnail(url=self.profileIconURL)
+        return m_embed
+
+    def format_post_message(self, post_title, post_url, category_name):
+        m_embed = discord.Embed(colour=discord.Colour.from_rgb(0, 184, 236))
+        m_embed.title = f"New discussion post: {post_title}"
+        m_embed.description = f"Posted in {category_name}"
+        if post_url:
+            m_embed.url = post_url
+        m_embed.set_thumbnail(url=self.profileIconURL)
+        return m_embed
+
+    def _format_edit(self, kind, item, username, old_body, old_title):
+        m_embed = discord.Embed(colour=discord.Colour.from_rgb(255, 196, 0))
+        if kind == "comment":
+            parent_post = self.posts.get(item["discussionID"])
+            thread_title = parent_post["name"] if parent_post else "a discussion"
+            m_embed.title = f"Comment edited by {username} in:\n {thread_title}"
+        else:
+            m_embed.title = f"Discussion post edited by {username}: {item['name']}"
+        description = ""
+        if old_title is not None and old_title != item["name"]:
+            description = f"Title was: ~~{old_title}~~\n"
+        if old_body is not None:
+            description += forumchanges.compact_diff(old_body, item["body"], self.characterLimit * 2)
+        m_embed.description = description[:2048]
+        m_embed.url = item['url']
+        m_embed.set_footer(text=f"Edited at {item.get('dateUpdated') or 'an unknown time'}")
+        m_embed.set_thumbnail(url=self.profileIconURL)
+        return m_embed
+
+    def _format_deletion(self, kind, item_id, username, old_body, old_title):
+        m_embed = discord.Embed(colour=discord.Colour.from_rgb(128, 128, 128))
+        if kind == "comment":
+            m_embed.title = f"Comment {item_id} by {username} was deleted"
+        else:
+            m_embed.title = f"Discussion post by {username} was deleted: {old_title}"
+        clean_text = self.body_texts.text((kind, int(item_id)), old_body or "", self.characterLimit)
+        if len(clean_text) > self.characterLimit:
+            clean_text = clean_text[:self.characterLimit] + "..."
+        m_embed.description = clean_text
+        m_embed.set_thumbnail(url=self.profileIconURL)
+        return m_embed
+
     async def check_loop(self):
         while not self.bot.is_closed():
             self.bot.logger.info("Checking for new comments and posts.")
             messages = await self.check_for_updates()
-            self.bot.logger.info(f"Found {len(messages['comments'])} new comments "
-                                 f"and {len(messages['discussions'])} new posts.")
-
+            self.bot.logger.info(f"Found {len(messages['comments'])} new comments, "
+                                 f"{len(messages['discussions'])} new posts "
+                                 f"and {len(messages['edits'])} edits or deletions.")
+            cache_stats = self.forum.cache.stats()
+            self.bot.logger.info(f"Forum cache: {cache_stats['hits']} hits, {cache_stats['revalidated']} revalidated, "
+                                 f"{cache_stats['misses']} misses, {cache_stats['memory_bytes']} bytes in memory.")
+
+            destinations = []
+            digest_guilds = {}
             for guildid in self.bot.guild_dict.keys():
-                output_channel_id = self.bot.guild_dict[guildid]['configure_dict'].get('comment_output_channel', 0)
+                configure_dict = self.bot.guild_dict[guildid].get('configure_dict', {})
+                output_channel_id = configure_dict.get('comment_output_channel', 0)
                 output_channel = None
                 if output_channel_id != 0:
                     output_channel = self.bot.get_channel(output_channel_id)
                 if output_channel:
-                    for m in messages["discussions"]:
-                        await output_channel.send(embed=m)
-                    for m in messages["comments"]:
-                        await output_channel.send(embed=m)
+                    destination = configure_dict.get('comment_output_webhook', output_channel)
+                    mode = configure_dict.get('comment_output_mode', 'realtime')
+                    if mode == 'realtime':
+                        destinations.append(destination)
+                    digest_guilds[guildid] = (mode, destination)
+            items = messages["discussions"] + messages["comments"] + messages["edits"]
+            delivered = await self.fanout.deliver(destinations, items)
+            if any(delivered):
+                complete = sum(1 for count in delivered if count == len(items))
+                self.bot.logger.info(f"Sent {len(items)} forum updates to {complete} of {len(destinations)} guilds.")
+            try:
+                self.digests.add([g for g, (mode, __) in digest_guilds.items() if mode != 'realtime'], items)
+                await self._send_digests(digest_guilds)
+            except Exception as e:
+                self.bot.logger.error(f"Failed to queue or send forum digests.\nFull error: {e}")
 
             await asyncio.sleep(self.bot.check_delay_minutes * 60)
 
-    def handle_forum_username(self, user):
+    async def _send_digests(self, digest_guilds):
+        """ Sends each guild's queued items once its digest is due. Items stay queued until
+        delivered, and a guild switched back to realtime gets what was left straight away."""
+        for guildid, (mode, destination) in digest_guilds.items():
+            row_ids, embeds = self.digests.due(guildid, mode)
+            if not embeds:
+                continue
+            if mode == 'realtime':
+                delivered, = await self.fanout.deliver([destination], embeds)
+            else:
+                digests = digest_embeds(embeds, mode)
+                sent_digests, = await self.fanout.deliver([destination], digests)
+                # each digest field is one queued item, so only the items of unsent digests are kept
+                delivered = sum(len(digest.fields) for digest in digests[:sent_digests])
+            if delivered:
+                self.digests.clear(guildid, row_ids[delivered - 1])
+                self.bot.logger.info(f"Sent a digest of {delivered} of {len(embeds)} forum updates to guild {guildid}.")
+
+    @commands.command(hidden=True, aliases=['scom'])
+    @commands.has_permissions(manage_roles=True)
+    async def set_comment_output_mode(self, ctx, mode):
+        """ Chooses how staff post notifications are sent to this server:
+        realtime (as soon as they are found), hourly or daily (grouped into a digest)."""
+        mode = mode.lower()
+        if mode not in DIGEST_MODES:
+            await ctx.channel.send(f"Mode must be one of: {', '.join(DIGEST_MODES)}.", delete_after=10)
+            return await ctx.message.add_reaction(self.bot.failed_react)
+        self.bot.guild_dict[ctx.guild.id]['configure_dict']['comment_output_mode'] = mode
+        pending = self.digests.pending(ctx.guild.id)
+        message = f"Staff post notifications will be sent {'as they are found' if mode == 'realtime' else mode}."
+        if pending:
+            message += f" {pending} queued updates will go out with the next check."
+        await ctx.channel.send(message, delete_after=10)
+        return await ctx.message.add_reaction(self.bot.success_react)
+
+    async def reaction_snapshot_loop(self):
+        """ Snapshots the reactions of watched posts every forum_reaction_snapshot_minutes.
+        Each snapshot only fetches the reaction pages added since the last one."""
+        interval = self.bot.config.get('forum_reaction_snapshot_minutes', 60) * 60
+        while not self.bot.is_closed():
+            for kind, item_id in self.reaction_history.watched(time.time() - interval):
+                if not self.forum.available(f"{kind}s/{item_id}/reactions"):
+                    break
+                try:
+                    await self.reaction_history.fetch(kind, item_id)
+                except ForumRequestError as e:
+                    self.bot.logger.warn(f"Failed to snapshot reactions for {kind} {item_id}\nFull error: {e}")
+                    if e.status == 404:
+                        self.reaction_history.unwatch(kind, item_id)
+            await asyncio.sleep(interval)
+
+    @commands.command(hidden=True, name='forum_poll_schedule', aliases=['fps'])
+    @commands.has_permissions(manage_roles=True)
+    async def forum_poll_schedule(self, ctx):
+        """ Shows when each tracked forum user will next be polled"""
+        now = time.time()
+        output_parts = []
+        for user_id, next_poll, interval in self.poll_schedule.schedule():
+            user = self.users.get(user_id)
+            if not user:
+                continue
+            minutes = max(int((next_poll - now) / 60), 0)
+            output_parts.append(f"**{user['name']}**: in {minutes} minutes (every {int(interval / 60)} minutes)\n")
+        if not output_parts:
+            return await ctx.send("No forum users have been scheduled yet.")
+        await utils.send_message_in_chunks(output_parts, ctx)
+
+    @commands.command(hidden=True, name='forum_search', aliases=['fsearch'])
+    async def forum_search(self, ctx, *, query):
+        """ Searches every staff comment and discussion the bot has captured, best matches first.
+        e.g. !forum_search "photo rejection" by:Casey after:2021-01-01
+        Filters: by:<name>, in:comments or in:discussions, after:<date>, before:<date>.
+        Use "quotes" for phrases, end a word with * to match prefixes, and OR/NOT between terms.
+        """
+        try:
+            match, filters = forumsearch.parse_query(query)
+        except ValueError as e:
+            error_response = await ctx.send(str(e))
+            return await self._cleanup(ctx.message, error_response)
+        if not match:
+            error_response = await ctx.send("Please include something to search for.")
+            return await self._cleanup(ctx.message, error_response)
+        try:
+            results = forumsearch.search(match, limit=10, **filters)
+        except Exception as e:
+            self.bot.logger.info(f"Forum search for {query} failed.\nFull error: {e}")
+            error_response = await ctx.send(f"Sorry, I couldn't search for **{query}**")
+            return await self._cleanup(ctx.message, error_response)
+        if not results:
+            return await ctx.send(f"No captured staff posts match **{query}**")
+        response_embed = discord.Embed(colour=discord.Colour.from_rgb(252, 71, 19))
+        response_embed.title = f"Staff posts matching: {query}"[:256]
+        for result in results:
+            kind = "Comment" if result["kind"] == "comment" else "Discussion"
+            response_embed.add_field(name=f"{kind} by {result['author']} on {result['dateinserted'][:10]}"[:256],
+                                     value=f"[{result['title'] or 'Untitled'}]({result['url']})\n"
+                                           f"{result['snippet']}"[:1024],
+                                     inline=False)
+        await ctx.send(embed=response_embed)
+
+    async def _forum_unavailable(self, ctx, error):
+        """Tells the user the forum is down rather than that what they asked for doesn't exist"""
+        if isinstance(error, CircuitOpenError):
+            text = f"The forum isn't responding right now, please try again in {int(error.retry_in) + 1} seconds."
+        else:
+            text = "The forum isn't responding right now, please try again later."
+        error_response = await ctx.send(text)
+        return await self._cleanup(ctx.message, error_response)
+
+    async def handle_forum_username(self, user):
         """ Allows forum functions to use smart IDs if desired,
         e.g. !profile 9
           or !profile NianticCasey-ING
@@ -505,45 +946,12 @@ class CommentScrapeCog(commands.Cog):
             return f"$name:{user}"
         if user.upper().endswith("-ING"):
             return f"$name:{user}"
-        read_only_flag = False
-        try:
-            with open('ID_alias_list.json') as json_file:
-                ID_alias_list = json.load(json_file)
-        except FileNotFoundError:
-            ID_alias_list = {}
-        except:
-            read_only_flag = True
-        if user in ID_alias_list:
-            return ID_alias_list[user]
-
-        # if user is not easily parsable or currently in the alias list, will make
-        # API calls to search for the currect game suffix. Worst case is three API
-        # calls being made for an invalid username. Successful calls will not have
-        # to be made again
-        response = requests.get(f"{self.wayforum_ep}/users/$name:{user}-PGO")
-        if response.status_code != 404:
-            if not read_only_flag:
-                ID_alias_list[user] = response.json()["userID"]
-                with open('ID_alias_list.json', 'w') as outfile:
-                    json.dump(ID_alias_list, outfile)
-            return response.json()["userID"]
-
-        response = requests.get(f"{self.wayforum_ep}/users/$name:{user}-ING")
-        if response.status_code != 404:
-            if not read_only_flag:
-                ID_alias_list[user] = response.json()["userID"]
-                with open('ID_alias_list.json', 'w') as outfile:
-                    json.dump(ID_alias_list, outfile)
-            return response.json()["userID"]
-
-        response = requests.get(f"{self.wayforum_ep}/users/$name:{user}")
-        if response.status_code != 404:
-            if not read_only_flag:
-                ID_alias_list[user] = response.json()["userID"]
-                with open('ID_alias_list.json', 'w') as outfile:
-                    json.dump(ID_alias_list, outfile)
-            return response.json()["userID"]
-
+        # if user is not easily parsable, the resolver checks its cache before probing
+        # the forum for every game suffix at once. Known names and recent misses are
+        # answered from memory
+        user_id = await self.aliases.resolve(user)
+        if user_id is not None:
+            return user_id
         return f"$name:{user}"
 
     def get_online_tier(self, elapsed):
@@ -555,29 +963,18 @@ class CommentScrapeCog(commands.Cog):
         else:
             return 2
 
-    @staticmethod
-    def forum_paginated_request(url):
-        """ Returns all pages for forum API calls that can have pagination"""
-        i = 1
-        pages = []
-        last_page = []
-        while True:
-            response = requests.get(f"{url}&page={i}")
-            # break loop if pages are not iterating or if page is blank
-            if response.json() == last_page or response.json() == []:
-                return pages
-            pages += response.json()
-            last_page = response.json()
-            i += 1
-
     @commands.command(hidden=True, name="get_online", aliases=["ol","online"])
     async def get_online(self, ctx, user):
         """ Returns the last time a user was active on the forum"""
-        response_profile = requests.get(f"{self.wayforum_ep}/users/{self.handle_forum_username(user)}")
-        profile = response_profile.json()
         try:
+            profile = await self.forum.get_json(f"users/{await self.handle_forum_username(user)}")
             date_last_active = profile["dateLastActive"]
-        except:
+        except ForumRequestError as e:
+            if isinstance(e, CircuitOpenError) or e.status is None or e.status in self.forum.retry_statuses:
+                return await self._forum_unavailable(ctx, e)
+            error_response = await ctx.send(f"Sorry, I wasn't able to find a forum user named **{user}**")
+            return await self._cleanup(ctx.message, error_response)
+        except Exception:
             error_response = await ctx.send(f"Sorry, I wasn't able to find a forum user named **{user}**")
             return await self._cleanup(ctx.message, error_response)
         # elapsed = datetime.now().timestamp() - datetime.fromisoformat(date_last_active).timestamp() # requires python 3.7
@@ -587,10 +984,10 @@ class CommentScrapeCog(commands.Cog):
     @commands.command(hidden=True, name="get_niantic_roles", aliases=["nia"])
     async def get_niantic_roles(self, ctx):
         """ Returns a list of all forum staff with their online status"""
-        response_nia = self.forum_paginated_request(f"{self.wayforum_ep}/users?roleID=$name:Niantic")
-        response_mod = self.forum_paginated_request(f"{self.wayforum_ep}/users?roleID=$name:Moderator")
-        response_admin = self.forum_paginated_request(f"{self.wayforum_ep}/users?roleID=$name:Administrator")
-        people = response_nia + response_mod + response_admin
+        try:
+            people = await self.roster.get()
+        except ForumRequestError as e:
+            return await self._forum_unavailable(ctx, e)
 
         # categorize users by online status
         green = []; yellow = []; red = []
@@ -632,11 +1029,15 @@ class CommentScrapeCog(commands.Cog):
     @commands.command(hidden=True, name="get_forum_profile", aliases=["fpf"])
     async def get_forum_profile(self, ctx, user):
         """ Returns information from a forum user's profile"""
-        response_profile = requests.get(f"{self.wayforum_ep}/users/{self.handle_forum_username(user)}")
-        profile = response_profile.json()
         try:
+            profile = await self.forum.get_json(f"users/{await self.handle_forum_username(user)}")
             date_last_active = profile["dateLastActive"]
-        except:
+        except ForumRequestError as e:
+            if isinstance(e, CircuitOpenError) or e.status is None or e.status in self.forum.retry_statuses:
+                return await self._forum_unavailable(ctx, e)
+            error_response = await ctx.send(f"Sorry, I wasn't able to find a forum user named **{user}**")
+            return await self._cleanup(ctx.message, error_response)
+        except Exception:
             error_response = await ctx.send(f"Sorry, I wasn't able to find a forum user named **{user}**")
             return await self._cleanup(ctx.message, error_response)
         # elapsed = datetime.now().timestamp() - datetime.fromisoformat(date_last_active).timestamp() # requires python 3.7
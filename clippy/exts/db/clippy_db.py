@@ -1,5 +1,5 @@
 from playhouse.apsw_ext import *
-from playhouse.sqlite_ext import JSONField
+from playhouse.sqlite_ext import FTS5Model, JSONField, RowIDField, SearchField
 from playhouse.migrate import *
 
 
@@ -15,13 +15,15 @@ class ClippyDB:
             'ignore_check_constraints': 0
         })
         cls._db.initialize(handle)
+        cls._migrator = SqliteMigrator(cls._db)
+        # add new columns to existing tables first, create_tables would otherwise index columns they don't have yet
+        cls.init()
         # ensure db matches current schema
         cls._db.create_tables([
-            ForumUserTable, CommentTable, ContestTable, DiscussionPostTable,
-            PermsTimerTable, ProfileTable, ThroneRoundTable
+            BackfillJobTable, ForumAliasTable, ForumUserTable, CommentTable, ContestTable, DigestItemTable,
+            DiscussionPostTable, ForumSearchTable, PermsTimerTable, ProfileTable, ReactionDeltaTable,
+            ReactionStateTable, ThroneRoundTable, WordCountTable
         ])
-        cls.init()
-        cls._migrator = SqliteMigrator(cls._db)
 
     @classmethod
     def stop(cls):
@@ -29,7 +31,26 @@ class ClippyDB:
 
     @classmethod
     def init(cls):
-        pass
+        cls._add_missing_columns(ForumUserTable)
+        cls._add_missing_columns(CommentTable)
+        cls._add_missing_columns(DiscussionPostTable)
+
+    @classmethod
+    def _add_missing_columns(cls, model):
+        # create_tables won't alter tables that already exist, so bring older
+        # databases up to the current model by adding new nullable columns
+        table = model._meta.table_name
+        if not cls._db.table_exists(table):
+            return
+        existing = {c.name: c for c in cls._db.get_columns(table)}
+        operations = []
+        for field in model._meta.sorted_fields:
+            if field.column_name not in existing:
+                operations.append(cls._migrator.add_column(table, field.column_name, field))
+            elif field.null and not existing[field.column_name].null:
+                operations.append(cls._migrator.drop_not_null(table, field.column_name))
+        if operations:
+            migrate(*operations)
 
 
 class BaseModel(Model):
@@ -39,15 +60,36 @@ class BaseModel(Model):
 
 class ForumUserTable(BaseModel):
     username = TextField(index=True)
+    userid = BigIntegerField(null=True, index=True)
+    excludecategories = JSONField(null=True)
+    lastcommentspage = IntegerField(null=True)
+    lastdiscussionspage = IntegerField(null=True)
+    latestcomment = BigIntegerField(null=True)
+    latestdiscussion = BigIntegerField(null=True)
 
     class Meta:
         constraints = [SQL('UNIQUE(username)')]
 
 
+class ForumAliasTable(BaseModel):
+    alias = TextField(index=True)
+    userid = BigIntegerField(null=True)
+    dateresolved = BigIntegerField()
+
+    class Meta:
+        constraints = [SQL('UNIQUE(alias)')]
+
+
 class CommentTable(BaseModel):
     commentid = BigIntegerField(index=True)
     forumuser = ForeignKeyField(ForumUserTable, field=ForumUserTable.username, backref='Comment', index=True)
     commenttext = TextField()
+    discussionid = BigIntegerField(null=True)
+    dateinserted = TextField(null=True)
+    dateupdated = TextField(null=True)
+    url = TextField(null=True)
+    contenthash = TextField(null=True)
+    datedeleted = TextField(null=True)
 
     class Meta:
         constraints = [SQL('UNIQUE(commentid)')]
@@ -55,13 +97,92 @@ class CommentTable(BaseModel):
 
 class DiscussionPostTable(BaseModel):
     discussionpostid = BigIntegerField(index=True)
-    forumuser = ForeignKeyField(ForumUserTable, field=ForumUserTable.username, backref='DiscussionPost', index=True)
+    forumuser = ForeignKeyField(ForumUserTable, field=ForumUserTable.username, backref='DiscussionPost', index=True,
+                                null=True)
     discussionposttext = TextField()
+    name = TextField(null=True)
+    categoryid = BigIntegerField(null=True)
+    insertuserid = BigIntegerField(null=True)
+    dateinserted = TextField(null=True)
+    dateupdated = TextField(null=True)
+    url = TextField(null=True)
+    contenthash = TextField(null=True)
+    datedeleted = TextField(null=True)
 
     class Meta:
         constraints = [SQL('UNIQUE(discussionpostid)')]
 
 
+class ForumSearchTable(FTS5Model):
+    # full-text index over CommentTable and DiscussionPostTable, kept up to date by
+    # clippy.poststore. rowid is itemid * 2 for comments and itemid * 2 + 1 for discussions
+    rowid = RowIDField()
+    kind = SearchField(unindexed=True)
+    itemid = SearchField(unindexed=True)
+    author = SearchField()
+    title = SearchField()
+    body = SearchField()
+    dateinserted = SearchField(unindexed=True)
+    url = SearchField(unindexed=True)
+
+    class Meta:
+        database = ClippyDB._db
+        options = {'tokenize': 'porter unicode61'}
+
+
+class DigestItemTable(BaseModel):
+    # a forum notification embed waiting for its guild's next digest
+    guildid = BigIntegerField(index=True)
+    dateadded = BigIntegerField()
+    embed = JSONField()
+
+
+class ReactionStateTable(BaseModel):
+    # last fetched reaction list of a forum post, as [userID, name, reaction type] triples
+    kind = TextField()
+    itemid = BigIntegerField()
+    reactions = JSONField()
+    datefetched = BigIntegerField()
+    watchuntil = BigIntegerField(null=True, index=True)
+
+    class Meta:
+        constraints = [SQL('UNIQUE(kind, itemid)')]
+
+
+class ReactionDeltaTable(BaseModel):
+    # change in reaction counts per type since the post's previous snapshot
+    kind = TextField()
+    itemid = BigIntegerField()
+    datetaken = BigIntegerField()
+    deltas = JSONField()
+
+    class Meta:
+        indexes = ((('kind', 'itemid', 'datetaken'), False),)
+
+
+class WordCountTable(BaseModel):
+    # how many times a user has said a word counted in a guild, written behind by clippy.wordcounts
+    guildid = BigIntegerField()
+    word = TextField()
+    userid = BigIntegerField()
+    count = IntegerField(default=0)
+
+    class Meta:
+        constraints = [SQL('UNIQUE(guildid, word, userid)')]
+
+
+class BackfillJobTable(BaseModel):
+    # a guild's word and react counter history backfill in progress, see clippy.backfill.
+    # progress maps channel ID to the last message counted, 0 before the first and -1 once done
+    guildid = BigIntegerField()
+    before = BigIntegerField()
+    counters = JSONField()
+    progress = JSONField()
+
+    class Meta:
+        constraints = [SQL('UNIQUE(guildid)')]
+
+
 class PermsTimerTable(BaseModel):
     permstimerid = AutoField()
     name = TextField(index=True)
@@ -1,6 +1,7 @@
 import json
 import os
 import re
+import time
 
 import discord
 from discord.ext import commands
@@ -57,13 +58,16 @@ class ReactCounter(commands.Cog):
                 channel = await utilities_cog.get_channel_by_name_or_id(ctx, c_id)
                 if channel:
                     channel_ids.append(channel.id)
-        self.counts[badge_emoji.id] = {
+        # keyed by str like the loaded JSON, so the counter works before the next restart
+        self.counts[str(badge_emoji.id)] = {
             "name": counter_name,
             "emoji_id": badge_emoji.id,
             "channel_ids": channel_ids,
             "user": member.id,
             "message": counter_message,
-            "count": 0
+            "count": 0,
+            "guild_id": ctx.guild.id,
+            "created": int(time.time())
         }
         await ctx.message.add_reaction(self.bot.success_react)
         success_msg = f"Counter '**{counter_name}**' added with emoji {badge_emoji}."
@@ -86,6 +90,22 @@ class ReactCounter(commands.Cog):
         react_count = self.counts[str(react_emoji.id)]
         await ctx.send(f"I have counted {react_count['count']} {react_count['message']}")
 
+    async def past_reaction_count(self, message, emoji_id):
+        """ Returns how many reactions with the counter's emoji on an existing message
+        on_raw_reaction_add would have counted. Costs a request per matching reaction.
+        """
+        counter = self.counts.get(str(emoji_id))
+        if counter is None or message.author.id != counter["user"]:
+            return 0
+        if len(counter["channel_ids"]) > 0 and message.channel.id not in counter["channel_ids"]:
+            return 0
+        for reaction in message.reactions:
+            if getattr(reaction.emoji, 'id', None) == int(emoji_id):
+                # the target reacting to their own message doesn't count
+                self_react = await reaction.users().get(id=message.author.id)
+                return reaction.count - (1 if self_react else 0)
+        return 0
+
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
         channel = self.bot.get_channel(payload.channel_id)
@@ -1,12 +1,17 @@
+import asyncio
 import json
 import os
 import random
 import re
+import time
 
 import discord
 from discord.ext import commands
 
 from clippy import utils
+from clippy.backfill import HistoryBackfill
+from clippy.wordcounts import WordCountStore
+from clippy.wordmatcher import KeywordMatcher
 
 
 class WordCounter(commands.Cog):
@@ -14,20 +19,51 @@ class WordCounter(commands.Cog):
         self.bot = bot
         self.counts = {}
         self.react_lists = {}
+        self.dispatch = {}
+        self.word_counts = WordCountStore()
+        self.backfills = {}
         self.get_word_counts()
         self.load_react_lists()
+        self.build_dispatch()
 
     def get_word_counts(self):
+        """ Loads the word counters from word_counts.json and their counts from WordCountTable.
+        Counts still in the JSON file from before the table existed are moved into it.
+        """
         try:
             with open(os.path.join('data', 'word_counts.json'), 'r') as fd:
                 self.counts = json.load(fd)
         except FileNotFoundError:
             self.counts = {}
+        self.word_counts.load()
+        legacy = False
+        for counter in self.counts.values():
+            old_counts = counter.pop("count", None)
+            if old_counts:
+                self.word_counts.import_counts(counter["guild_id"], counter["counted_word"], old_counts)
+                legacy = True
+        if legacy:
+            self.save_word_counts()
 
     def save_word_counts(self):
+        self.word_counts.flush()
         with open(os.path.join('data', 'word_counts.json'), 'w') as fd:
             json.dump(self.counts, fd, indent=4)
 
+    def cog_unload(self):
+        self.word_counts.flush()
+
+    async def flush_loop(self):
+        """Writes counted words to the database every word_count_flush_seconds"""
+        interval = self.bot.config.get('word_count_flush_seconds', 5)
+        while not self.bot.is_closed():
+            await asyncio.sleep(interval)
+            try:
+                self.word_counts.flush()
+            except Exception as e:
+                self.bot.logger.error(f"Failed to flush word counts, {self.word_counts.pending} kept for the next "
+                                      f"try. Error: {str(e)}")
+
     def load_react_lists(self):
         try:
             with open(os.path.join('data', 'react_lists.json'), 'r') as fd:
@@ -39,6 +75,55 @@ class WordCounter(commands.Cog):
         with open(os.path.join('data', 'react_lists.json'), 'w') as fd:
             json.dump(self.react_lists, fd, indent=4)
 
+    def _rules(self, guild_id, channel_id):
+        """ Returns the dispatch entry for react lists and counters scoped to one channel
+        of a guild, or to all of its channels when channel_id is "none".
+        """
+        scopes = self.dispatch.setdefault(guild_id, {})
+        if channel_id not in scopes:
+            scopes[channel_id] = {"react": [], "count": [], "matcher": KeywordMatcher()}
+        return scopes[channel_id]
+
+    @staticmethod
+    def _counter_channels(counter):
+        return list(dict.fromkeys(counter["channel_ids"])) or ["none"]
+
+    def _index_react_list(self, rl_name):
+        react_list = self.react_lists[rl_name]
+        rules = self._rules(react_list["guild_id"], react_list["channel_id"])
+        if rl_name not in rules["react"]:
+            rules["react"].append(rl_name)
+        for word in react_list["words"]:
+            rules["matcher"].add(("react", rl_name), word)
+
+    def _index_counter(self, key):
+        counter = self.counts[key]
+        for channel_id in self._counter_channels(counter):
+            rules = self._rules(counter["guild_id"], channel_id)
+            if key not in rules["count"]:
+                rules["count"].append(key)
+            rules["matcher"].add(("count", key), counter["counted_word"], plural=True)
+
+    def _unindex_counter(self, key):
+        counter = self.counts.get(key)
+        if counter is None:
+            return
+        for channel_id in self._counter_channels(counter):
+            rules = self._rules(counter["guild_id"], channel_id)
+            if key in rules["count"]:
+                rules["count"].remove(key)
+            rules["matcher"].remove(("count", key), counter["counted_word"], plural=True)
+
+    def build_dispatch(self):
+        """ Indexes react lists and word counters as guild_id -> channel_id or "none" -> rules,
+        so a message only looks at the rules that can apply to its channel.
+        """
+        self.dispatch = {}
+        for rl_name in self.react_lists:
+            self._index_react_list(rl_name)
+        for key in self.counts:
+            self._index_counter(key)
+
     @commands.command(name="add_react_list", aliases=['arl'])
     @commands.has_permissions(manage_roles=True)
     async def add_react_list(self, ctx, *, info):
@@ -96,6 +181,7 @@ class WordCounter(commands.Cog):
             "guild_id": ctx.guild.id,
             "words": words
         }
+        self._index_react_list(rl_name)
         await ctx.message.add_reaction(self.bot.success_react)
 
     @commands.command(name="add_word_to_react_list", aliases=['awrl'])
@@ -116,6 +202,8 @@ class WordCounter(commands.Cog):
             await ctx.send(f"{word} is already in the react list for {name}.", delete_after=10)
             return await ctx.message.add_reaction(self.bot.failed_react)
         self.react_lists[rl_name]["words"].append(word)
+        rules = self._rules(ctx.guild.id, self.react_lists[rl_name]["channel_id"])
+        rules["matcher"].add(("react", rl_name), word)
         return await ctx.message.add_reaction(self.bot.success_react)
 
     @commands.command(name="remove_word_from_react_list", aliases=['rwrl'])
@@ -136,6 +224,9 @@ class WordCounter(commands.Cog):
             await ctx.send(f"{word} is not in the react list for {name}.", delete_after=10)
             return await ctx.message.add_reaction(self.bot.failed_react)
         self.react_lists[rl_name]["words"].remove(word)
+        if word not in self.react_lists[rl_name]["words"]:
+            rules = self._rules(ctx.guild.id, self.react_lists[rl_name]["channel_id"])
+            rules["matcher"].remove(("react", rl_name), word)
         return await ctx.message.add_reaction(self.bot.success_react)
 
     @commands.command(name='add_word_counter', aliases=['awc'])
@@ -165,12 +256,15 @@ class WordCounter(commands.Cog):
                 if channel:
                     channel_ids.append(channel.id)
         rl_name = f"{ctx.guild.id}_{counted_word}"
+        self._unindex_counter(rl_name)
         self.counts[rl_name] = {
             "counted_word": counted_word,
             "guild_id": ctx.guild.id,
             "channel_ids": channel_ids,
-            "count": {}
+            "created": int(time.time())
         }
+        self.word_counts.reset(ctx.guild.id, counted_word)
+        self._index_counter(rl_name)
         await ctx.message.add_reaction(self.bot.success_react)
         success_msg = f"Word Counter for '**{counted_word}**' added."
         if len(channel_ids) > 0:
@@ -178,6 +272,48 @@ class WordCounter(commands.Cog):
         self.save_word_counts()
         return await ctx.send(success_msg, delete_after=10)
 
+    @commands.command(name='backfill_counters', aliases=['bfc'])
+    @commands.has_permissions(manage_roles=True)
+    async def backfill_counters(self, ctx, action="start"):
+        """
+        Do '!backfill_counters' to count past messages for word and react counters added since they were sent.
+        Progress is posted as it goes, and a stopped or interrupted backfill picks up where it left off.
+        Do '!backfill_counters stop' to stop one that is running.
+        Also works with '!bfc'
+        """
+        running = self.backfills.get(ctx.guild.id)
+        if action == "stop":
+            if running is None:
+                return await ctx.send("No backfill is running.", delete_after=10)
+            running.cancel()
+            return await ctx.message.add_reaction(self.bot.success_react)
+        if running is not None:
+            await ctx.message.add_reaction(self.bot.failed_react)
+            return await ctx.send("A backfill is already running. Use `!backfill_counters stop` to stop it.",
+                                  delete_after=10)
+        progress_message = await ctx.send("Backfill starting...")
+        backfill = HistoryBackfill(self.bot, ctx.guild,
+                                   batch_size=self.bot.config.get('backfill_batch_size', 100),
+                                   pause_seconds=self.bot.config.get('backfill_pause_seconds', 1),
+                                   report=lambda text: progress_message.edit(content=text),
+                                   report_seconds=self.bot.config.get('backfill_report_seconds', 30))
+        if backfill.job() is None:
+            return await progress_message.edit(content="No counters need a backfill.")
+        self.backfills[ctx.guild.id] = self.bot.event_loop.create_task(self._run_backfill(backfill, progress_message))
+        await ctx.message.add_reaction(self.bot.success_react)
+
+    async def _run_backfill(self, backfill, progress_message):
+        try:
+            await backfill.run()
+        except asyncio.CancelledError:
+            await progress_message.edit(content=f"Backfill stopped. {backfill.scanned} messages read this run; "
+                                                f"`!backfill_counters` resumes it.")
+        except Exception as e:
+            self.bot.logger.error(f"Backfill failed in {backfill.guild.name}. Error: {str(e)}")
+            await progress_message.edit(content="Backfill failed, `!backfill_counters` resumes it.")
+        finally:
+            self.backfills.pop(backfill.guild.id, None)
+
     @commands.command(name="list_word_counter", aliases=['lwc'])
     @commands.has_permissions(manage_roles=True)
     async def list_word_counter(self, ctx):
@@ -225,11 +361,14 @@ class WordCounter(commands.Cog):
         print(raw_word)
         if raw_word == "scores" or raw_word == "score":
             add = True
-        user_counts = self.counts[word]["count"]
+        user_counts = self.word_counts.counts(ctx.guild.id, self.counts[word]["counted_word"])
         if str(ctx.message.author.id) not in user_counts:
             return await ctx.send(f'You haven\'t said "{raw_word}" at all!')
         word_count = user_counts[str(ctx.message.author.id)]
         message = f'You\'ve said "{raw_word}" {word_count} times!'
+        rank = self._leaderboard(ctx.guild, self.counts[word]["counted_word"]).rank(str(ctx.message.author.id))
+        if rank is not None:
+            message += f" That's #{rank} on the leaderboard."
         if add:
             message += "\n(haha whoops!!)"
         return await ctx.send(message)
@@ -253,17 +392,19 @@ class WordCounter(commands.Cog):
             word = singular
         else:
             return await ctx.send(f"{raw_word} is not being counted right now.")
-        user_counts = self.counts[word]["count"]
-        sorted_user_counts = {k: v for k, v in
-                              sorted(user_counts.items(), key=lambda item: item[1], reverse=True)}
-        top_ten = list(sorted_user_counts.keys())[:10]
+        board = self._leaderboard(ctx.guild, self.counts[word]["counted_word"])
+        top_ten = board.top(10)
+        # members can leave without the event reaching us, so hide any found missing and look again
+        missing = [user_id for user_id, __ in top_ten if not ctx.guild.get_member(int(user_id))]
+        while missing:
+            for user_id in missing:
+                board.hide(user_id)
+            top_ten = board.top(10)
+            missing = [user_id for user_id, __ in top_ten if not ctx.guild.get_member(int(user_id))]
         description = ""
         count = 1
-        for user_id in top_ten:
-            word_count = sorted_user_counts[user_id]
+        for user_id, word_count in top_ten:
             member = ctx.guild.get_member(int(user_id))
-            if not member:
-                continue
             description += f"{count}. **{member.display_name}** - {word_count}\n"
             count += 1
         lb_embed = discord.Embed(title=f'Top {count - 1} "{self.counts[word]["counted_word"]}" sayers',
@@ -271,8 +412,38 @@ class WordCounter(commands.Cog):
         await ctx.send(embed=lb_embed)
 
 
+    def _leaderboard(self, guild, counted_word):
+        return self.word_counts.leaderboard(guild.id, counted_word,
+                                            lambda user_id: guild.get_member(int(user_id)) is not None)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.word_counts.hide_user(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        self.word_counts.show_user(member.guild.id, member.id)
+
     @commands.Cog.listener()
     async def on_message(self, message):
+        check_str = self._check_string(message)
+        #check_str = f"{message.guild.id}_{check_str}"
+        if message.author != self.bot.user and message.guild:
+            rules, hits = self._match(message, check_str)
+            if not hits:
+                return
+            for scope in rules:
+                for name in scope["react"]:
+                    if ("react", name) in hits:
+                        try:
+                            await message.add_reaction(self.react_lists[name]["emoji"])
+                        except Exception as e:
+                            pass
+            for key in self._counted(rules, hits, check_str):
+                self.word_counts.increment(message.guild.id, self.counts[key]["counted_word"], message.author.id)
+
+    @staticmethod
+    def _check_string(message):
         check_str = message.clean_content.lower()
         # walsh
         if message.author.id == 188389841845616640:
@@ -283,32 +454,32 @@ class WordCounter(commands.Cog):
         else:
             if random.randint(1, 10) < 3:
                 check_str = check_str.replace('\u200b', '')
-        #check_str = f"{message.guild.id}_{check_str}"
-        if message.author != self.bot.user:
-            for name in self.react_lists:
-                this_react = self.react_lists[name]
-                if this_react["guild_id"] == message.guild.id:
-                    if this_react["channel_id"] == "none" or message.channel.id == this_react["channel_id"]:
-                        for word in this_react["words"]:
-                            if self._has_string(fr"\b{word}\b", check_str):
-                                try:
-                                    await message.add_reaction(this_react["emoji"])
-                                except Exception as e:
-                                    pass
-            if not check_str.startswith("!"):
-                for key in self.counts.keys():
-                    if self.counts[key]["guild_id"] == message.guild.id:
-                        word = self.counts[key]["counted_word"]
-                        if self._has_string(fr"\b{word}(s)*\b", check_str):
-                            if len(self.counts[key]["channel_ids"]) > 0:
-                                if message.channel.id not in self.counts[key]["channel_ids"]:
-                                    continue
-                            author_id = str(message.author.id)
-                            if author_id not in self.counts[key]["count"]:
-                                self.counts[key]["count"][author_id] = 0
-                            self.counts[key]["count"][author_id] += 1
+        return check_str
 
+    def _match(self, message, check_str):
+        """Returns the dispatch entries that apply to the message's channel and the rules they matched"""
+        scopes = self.dispatch.get(message.guild.id)
+        if not scopes:
+            return [], set()
+        rules = [scopes[channel_id] for channel_id in ("none", message.channel.id) if channel_id in scopes]
+        hits = set()
+        for scope in rules:
+            hits |= scope["matcher"].matches(check_str)
+        return rules, hits
+
+    @staticmethod
+    def _counted(rules, hits, check_str):
+        if check_str.startswith("!"):
+            return []
+        return [key for scope in rules for key in scope["count"] if ("count", key) in hits]
 
+    def counted_words(self, message):
+        """Returns the keys of the word counters a message counts towards, as on_message counts it"""
+        if message.author == self.bot.user or not message.guild:
+            return []
+        check_str = self._check_string(message)
+        rules, hits = self._match(message, check_str)
+        return self._counted(rules, hits, check_str)
 
     @staticmethod
     def _check_words(word_list, message):
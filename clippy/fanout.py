@@ -0,0 +1,73 @@
+import asyncio
+import inspect
+
+import discord
+
+
+class EmbedFanout:
+    """ Sends the same list of embeds to many channels or webhooks.
+    Embeds are packed up to 10 per message (and under Discord's 6000 character
+    total), destinations are sent to concurrently and each destination's
+    messages go out in order. discord.py's HTTP client already waits out
+    per-route rate limits; concurrency caps how many routes are busy at once.
+    """
+    max_embeds = 10
+    max_characters = 6000
+
+    def __init__(self, bot, concurrency=5):
+        self.bot = bot
+        self._limit = asyncio.Semaphore(concurrency)
+        # channels only accept several embeds per message on newer discord.py releases
+        self._channel_multi_embed = 'embeds' in inspect.signature(discord.abc.Messageable.send).parameters
+
+    def _webhook(self, url):
+        if hasattr(discord, 'AsyncWebhookAdapter'):
+            return discord.Webhook.from_url(url, adapter=discord.AsyncWebhookAdapter(self.bot.session))
+        return discord.Webhook.from_url(url, session=self.bot.session)
+
+    def pack(self, embeds, max_embeds=None):
+        max_embeds = max_embeds or self.max_embeds
+        batches = []
+        batch, characters = [], 0
+        for embed in embeds:
+            if batch and (len(batch) >= max_embeds or characters + len(embed) > self.max_characters):
+                batches.append(batch)
+                batch, characters = [], 0
+            batch.append(embed)
+            characters += len(embed)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def deliver(self, destinations, embeds):
+        """ destinations is a list of text channels or webhook URLs.
+        Returns how many of the embeds each destination got. Embeds go out in
+        order, so a destination that failed partway got the first ones and a
+        retry only needs the rest. Failures are logged.
+        """
+        if not embeds:
+            return [0] * len(destinations)
+        return await asyncio.gather(*[self._deliver_to(d, embeds) for d in destinations])
+
+    async def _deliver_to(self, destination, embeds):
+        delivered = 0
+        try:
+            async with self._limit:
+                if isinstance(destination, str):
+                    webhook = self._webhook(destination)
+                    for batch in self.pack(embeds):
+                        await webhook.send(embeds=batch)
+                        delivered += len(batch)
+                elif self._channel_multi_embed:
+                    for batch in self.pack(embeds):
+                        await destination.send(embeds=batch)
+                        delivered += len(batch)
+                else:
+                    for embed in embeds:
+                        await destination.send(embed=embed)
+                        delivered += 1
+        except Exception as e:
+            name = getattr(destination, 'name', 'webhook')
+            self.bot.logger.warn(f"Failed to deliver forum updates to {name} after {delivered} of {len(embeds)}."
+                                 f"\nFull error: {e}")
+        return delivered
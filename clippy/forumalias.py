@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+from clippy.exts.db.clippy_db import ClippyDB, ForumAliasTable
+from clippy.forumclient import ForumRequestError
+
+
+class AliasResolver:
+    """ Resolves forum names without a game suffix to user IDs.
+    Answers come from an in-process LRU, then ForumAliasTable, and only then
+    from the forum, where every suffix variant is probed at once and the first
+    one found wins. Names the forum doesn't know are remembered for
+    negative_ttl seconds so repeated typos don't hit the API.
+    """
+    suffixes = ["-PGO", "-ING", ""]
+
+    def __init__(self, forum, negative_ttl=3600, cache_limit=1024):
+        self.forum = forum
+        self.negative_ttl = negative_ttl
+        self.cache_limit = cache_limit
+        self._cache = OrderedDict()
+
+    async def resolve(self, alias):
+        found, user_id = self._lookup(alias)
+        if found:
+            return user_id
+        user_id, definitive = await self._probe(alias)
+        if user_id is not None or definitive:
+            self._store(alias, user_id)
+        return user_id
+
+    def _lookup(self, alias):
+        entry = self._cache.get(alias)
+        if entry is None:
+            row = ForumAliasTable.get_or_none(ForumAliasTable.alias == alias)
+            if row is None:
+                return False, None
+            entry = (row.userid, row.dateresolved)
+        user_id, date_resolved = entry
+        if user_id is None and time.time() > date_resolved + self.negative_ttl:
+            self._cache.pop(alias, None)
+            return False, None
+        self._remember(alias, entry)
+        return True, user_id
+
+    def _store(self, alias, user_id):
+        now = int(time.time())
+        ForumAliasTable.insert(alias=alias, userid=user_id, dateresolved=now).on_conflict(
+            conflict_target=[ForumAliasTable.alias],
+            preserve=[ForumAliasTable.userid, ForumAliasTable.dateresolved]).execute()
+        self._remember(alias, (user_id, now))
+
+    def _remember(self, alias, entry):
+        self._cache[alias] = entry
+        self._cache.move_to_end(alias)
+        while len(self._cache) > self.cache_limit:
+            self._cache.popitem(last=False)
+
+    async def _probe(self, alias):
+        """Returns (user_id, definitive); definitive is False if any probe failed for a reason other than a 404"""
+        probes = [asyncio.ensure_future(self._probe_name(f"{alias}{suffix}")) for suffix in self.suffixes]
+        definitive = True
+        try:
+            for next_done in asyncio.as_completed(probes):
+                try:
+                    user_id = await next_done
+                except ForumRequestError:
+                    definitive = False
+                    continue
+                if user_id is not None:
+                    return user_id, True
+            return None, definitive
+        finally:
+            for probe in probes:
+                probe.cancel()
+
+    async def _probe_name(self, name):
+        try:
+            profile = await self.forum.get_json(f"users/$name:{name}", ttl=3600)
+        except ForumRequestError as e:
+            if e.status == 404:
+                return None
+            raise
+        return profile["userID"]
+
+    def import_json(self, filename):
+        """One-off import of the old ID_alias_list.json when no aliases are stored yet"""
+        if ForumAliasTable.select().exists() or not os.path.exists(filename):
+            return 0
+        try:
+            with open(filename, 'r') as fd:
+                aliases = json.load(fd)
+        except ValueError:
+            return 0
+        now = int(time.time())
+        with ClippyDB._db.atomic():
+            for alias, user_id in aliases.items():
+                ForumAliasTable.insert(alias=alias, userid=user_id, dateresolved=now).on_conflict_ignore().execute()
+        return len(aliases)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+
+class CacheEntry:
+    def __init__(self, body, etag=None, last_modified=None, expires=0):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def is_fresh(self):
+        return time.time() < self.expires
+
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_dict(self):
+        return {"body": self.body, "etag": self.etag,
+                "last_modified": self.last_modified, "expires": self.expires}
+
+
+class ForumCache:
+    """ Two tier response cache for the forum client.
+    Bodies are kept in an LRU memory tier bounded by total body size, backed by
+    one JSON file per response on disk so validators survive a restart.
+    Stale entries are revalidated with If-None-Match/If-Modified-Since.
+    """
+    def __init__(self, directory, max_memory_bytes=8 * 1024 * 1024, max_disk_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        # answers served past their expiry because the forum failed or its circuit was open
+        self.stale = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(url, params=None):
+        if params:
+            return f"{url}?{urlencode(sorted(params.items()))}"
+        return url
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        try:
+            with open(self._path(key), 'r') as fd:
+                entry = CacheEntry(**json.load(fd))
+        except (OSError, ValueError, TypeError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        self._write(key, entry)
+
+    def touch(self, key, entry, expires):
+        """Extends an entry's lifetime after the forum confirmed it is unchanged"""
+        entry.expires = expires
+        self._write(key, entry)
+
+    def _remember(self, key, entry):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.size
+        self._memory[key] = entry
+        self._memory_bytes += entry.size
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            __, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.size
+
+    def _write(self, key, entry):
+        path = self._path(key)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as tf:
+                json.dump(entry.to_dict(), tf)
+                tempname = tf.name
+            os.replace(tempname, path)
+        except OSError:
+            return
+        if self._disk_bytes is None:
+            self._disk_bytes = self._scan_disk_usage()
+        else:
+            self._disk_bytes += os.path.getsize(path) - old_size
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _scan_disk_usage(self):
+        return sum(e.stat().st_size for e in os.scandir(self.directory) if e.is_file())
+
+    def _evict_disk(self):
+        # drop the least recently written files until the tier is back under 90% of its budget
+        files = sorted((e for e in os.scandir(self.directory) if e.is_file()), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in files)
+        for e in files:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                size = e.stat().st_size
+                os.remove(e.path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def stats(self):
+        lookups = self.hits + self.revalidated + self.misses
+        return {"hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": (self.hits + self.revalidated) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes}
@@ -0,0 +1,78 @@
+import difflib
+import hashlib
+
+from clippy.forumhtml import html_to_text
+
+
+def content_hash(*parts):
+    return hashlib.sha1("\x00".join(part or "" for part in parts).encode('utf-8')).hexdigest()
+
+
+def comment_hash(comment):
+    return content_hash(comment["body"])
+
+
+def discussion_hash(discussion):
+    return content_hash(discussion["name"], discussion["body"])
+
+
+def find_changes(items, id_key, hash_item, stored):
+    """ Compares re-fetched posts against the stored versions.
+    items is a contiguous run of posts from the forum, stored maps post ID to
+    (content hash, dateUpdated) for the same author. Returns (edited, updated,
+    deleted): posts whose content changed, posts whose stored version needs
+    refreshing without a notification (dateUpdated moved but the content did
+    not, or no hash was stored yet) and IDs of stored posts inside the fetched
+    ID range that the forum no longer returns.
+    """
+    edited, updated = [], []
+    seen = set()
+    for item in items:
+        item_id = int(item[id_key])
+        seen.add(item_id)
+        if item_id not in stored:
+            continue
+        stored_hash, stored_updated = stored[item_id]
+        new_hash = hash_item(item)
+        if stored_hash is None:
+            updated.append(item)
+        elif new_hash != stored_hash:
+            edited.append(item)
+        elif item.get("dateUpdated") != stored_updated:
+            updated.append(item)
+    deleted = []
+    if seen:
+        low, high = min(seen), max(seen)
+        deleted = [item_id for item_id in stored if low <= item_id <= high and item_id not in seen]
+    return edited, updated, sorted(deleted)
+
+
+def compact_diff(old_html, new_html, limit=600, context=6):
+    """ Word-level diff of two post bodies for an embed: removed words are
+    ~~struck out~~, added words **bold**, and unchanged runs longer than
+    2 * context words are cut down to their ends.
+    """
+    old_words = html_to_text(old_html).split()
+    new_words = html_to_text(new_html).split()
+    parts = []
+    matcher = difflib.SequenceMatcher(None, old_words, new_words, autojunk=False)
+    opcodes = matcher.get_opcodes()
+    if all(opcode[0] == 'equal' for opcode in opcodes):
+        return "(only formatting changed)"
+    for index, (tag, old_start, old_end, new_start, new_end) in enumerate(opcodes):
+        if tag == 'equal':
+            words = old_words[old_start:old_end]
+            head = words[:context] if index > 0 else []
+            tail = words[-context:] if index < len(opcodes) - 1 else []
+            if len(words) > len(head) + len(tail):
+                words = head + ["..."] + tail
+            parts.append(" ".join(words))
+            continue
+        if old_end > old_start:
+            parts.append("~~" + " ".join(old_words[old_start:old_end]) + "~~")
+        if new_end > new_start:
+            parts.append("**" + " ".join(new_words[new_start:new_end]) + "**")
+    text = " ".join(part for part in parts if part)
+    if len(text) > limit:
+        text = text[:limit - 3] + "..."
+    return text
@@ -0,0 +1,255 @@
+import asyncio
+import codecs
+import json
+import math
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from clippy.circuitbreaker import CircuitBreaker, parse_retry_after
+from clippy.forumcache import CacheEntry
+
+
+class ForumRequestError(Exception):
+    """Raised when a forum request fails or returns an error status"""
+    def __init__(self, url, status=None):
+        self.url = url
+        self.status = status
+        super().__init__(f"Forum request to {url} failed with status {status}")
+
+
+class CircuitOpenError(ForumRequestError):
+    """Raised without contacting the forum while the endpoint's circuit breaker is open"""
+    def __init__(self, url, retry_in):
+        self.url = url
+        self.status = None
+        self.retry_in = retry_in
+        Exception.__init__(self, f"Forum endpoint for {url} is unavailable for another {math.ceil(retry_in)} seconds")
+
+
+class ForumResponse:
+    def __init__(self, url, status, headers, data):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+
+class ForumClient:
+    """ Async client for the Wayfarer forum, built on the bot's shared aiohttp session.
+    Requests are capped per host, time out individually and are retried with
+    jittered exponential backoff when the forum errors or rate limits.
+    If a ForumCache is given, responses are served from it while fresh and
+    revalidated with their ETag/Last-Modified once they go stale.
+    Each endpoint has a CircuitBreaker: while it is open, requests are answered
+    from the cache even if stale, or fail at once with CircuitOpenError.
+    """
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, bot, base_url, timeout=15, retries=3, per_host_limit=6, backoff_seconds=0.5,
+                 cache=None, default_ttl=0, breaker_failures=5, breaker_reset_seconds=30,
+                 breaker_max_reset_seconds=600):
+        self.bot = bot
+        self.cache = cache
+        self.default_ttl = default_ttl
+        self.base_url = base_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.per_host_limit = per_host_limit
+        self.backoff_seconds = backoff_seconds
+        self._host_limits = {}
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self.breaker_max_reset_seconds = breaker_max_reset_seconds
+        self.breakers = {}
+
+    @property
+    def session(self):
+        if self.bot.session is None:
+            self.bot.session = aiohttp.ClientSession()
+        return self.bot.session
+
+    def _url(self, path):
+        if path.startswith("http"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    def endpoint(self, path):
+        """ Groups URLs by endpoint for the circuit breakers, e.g. discussions/123/reactions
+        becomes discussions/{id}/reactions. Pages outside the API are grouped by site section.
+        """
+        url = self._url(path)
+        if url.startswith(self.base_url + '/'):
+            segments = url[len(self.base_url) + 1:].split('?')[0].split('/')
+            return "/".join(s if i % 2 == 0 else "{id}" for i, s in enumerate(segments))
+        parts = urlsplit(url)
+        return parts.netloc + "/" + parts.path.strip('/').split('/')[0]
+
+    def breaker(self, path):
+        endpoint = self.endpoint(path)
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(self.breaker_failures, self.breaker_reset_seconds,
+                                                     self.breaker_max_reset_seconds)
+        return self.breakers[endpoint]
+
+    def available(self, path):
+        """False while the endpoint's circuit is open and requests to it would fail fast"""
+        breaker = self.breaker(path)
+        return breaker.state == breaker.CLOSED or breaker.retry_in() == 0
+
+    def _fail_fast(self, url, breaker, entry, as_json):
+        if entry is not None:
+            self.cache.stale += 1
+            return self._decode(url, 200, {}, entry.body, as_json)
+        raise CircuitOpenError(url, breaker.retry_in())
+
+    async def _backoff(self, attempt):
+        # full jitter keeps retries from every caller landing on the forum at once
+        await asyncio.sleep(random.uniform(0, self.backoff_seconds * (2 ** attempt)))
+
+    async def request(self, path, params=None, headers=None, as_json=True, ttl=None):
+        url = self._url(path)
+        entry, cache_key = None, None
+        if self.cache is not None:
+            cache_key = self.cache.key(url, params)
+            entry = self.cache.get(cache_key)
+            if entry is not None and entry.is_fresh():
+                self.cache.hits += 1
+                return self._decode(url, 200, {}, entry.body, as_json)
+            if entry is not None:
+                headers = {**entry.validators(), **(headers or {})}
+        breaker = self.breaker(path)
+        status = None
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await self._backoff(attempt - 1)
+            try:
+                async with self._host_limit(url):
+                    # checked after queueing too, so waiting requests don't pile onto a failing forum
+                    if not breaker.allow():
+                        return self._fail_fast(url, breaker, entry, as_json)
+                    async with self.session.get(url, params=params, headers=headers,
+                                                timeout=self.timeout) as response:
+                        status = response.status
+                        if status in self.retry_statuses:
+                            retry_after = None
+                            if status == 429:
+                                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                            breaker.record_failure(retry_after)
+                            continue
+                        breaker.record_success()
+                        if status == 304 and entry is not None:
+                            self.cache.revalidated += 1
+                            self.cache.touch(cache_key, entry, self._expiry(ttl))
+                            return self._decode(url, status, response.headers, entry.body, as_json)
+                        if status >= 400:
+                            raise ForumRequestError(url, status)
+                        body = await response.text()
+                        if self.cache is not None:
+                            self.cache.misses += 1
+                            self.cache.put(cache_key, CacheEntry(body, response.headers.get('ETag'),
+                                                                 response.headers.get('Last-Modified'),
+                                                                 self._expiry(ttl)))
+                        return self._decode(url, status, response.headers, body, as_json)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                breaker.record_failure()
+                status = None
+        if entry is not None:
+            # a stale answer beats none while the forum is struggling
+            self.cache.stale += 1
+            return self._decode(url, 200, {}, entry.body, as_json)
+        raise ForumRequestError(url, status)
+
+    def _expiry(self, ttl):
+        return time.time() + (self.default_ttl if ttl is None else ttl)
+
+    @staticmethod
+    def _decode(url, status, headers, body, as_json):
+        if not as_json:
+            return ForumResponse(url, status, headers, body)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            raise ForumRequestError(url, status)
+        return ForumResponse(url, status, headers, data)
+
+    async def get_json(self, path, params=None, ttl=None):
+        response = await self.request(path, params=params, ttl=ttl)
+        return response.data
+
+    async def get_text(self, path, params=None, ttl=None):
+        response = await self.request(path, params=params, as_json=False, ttl=ttl)
+        return response.data
+
+    async def iter_text(self, path, params=None, chunk_size=16384):
+        """ Yields a page's text in chunks as it downloads, so a caller can stop reading early.
+        Streamed responses bypass the cache and aren't retried, since part of the
+        body may already have been consumed.
+        """
+        url = self._url(path)
+        breaker = self.breaker(path)
+        async with self._host_limit(url):
+            if not breaker.allow():
+                raise CircuitOpenError(url, breaker.retry_in())
+            try:
+                async with self.session.get(url, params=params, timeout=self.timeout) as response:
+                    if response.status in self.retry_statuses:
+                        retry_after = None
+                        if response.status == 429:
+                            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        breaker.record_failure(retry_after)
+                        raise ForumRequestError(url, response.status)
+                    breaker.record_success()
+                    if response.status >= 400:
+                        raise ForumRequestError(url, response.status)
+                    decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        yield decoder.decode(chunk)
+                    yield decoder.decode(b'', final=True)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                breaker.record_failure()
+                raise ForumRequestError(url, None)
+
+    async def iter_pages(self, path, params=None, start_page=1, ttl=None):
+        """ Lazily yields (page_number, items) for a paginated API call.
+        Stops on an empty page, on a page shorter than params["limit"], when the
+        Link header has no rel="next", or when the forum repeats the previous
+        page. Callers can stop early by breaking out of the loop.
+        """
+        params = dict(params or {})
+        page_size = params.get("limit")
+        page = start_page
+        last_bounds = None
+        while True:
+            response = await self.request(path, params={**params, "page": page}, ttl=ttl)
+            items = response.data or []
+            if not items:
+                return
+            # past the end some endpoints serve the last page again
+            bounds = (items[0], items[-1])
+            if bounds == last_bounds:
+                return
+            yield page, items
+            if page_size and len(items) < int(page_size):
+                return
+            link = response.headers.get('Link')
+            if link is not None and 'rel="next"' not in link:
+                return
+            last_bounds = bounds
+            page += 1
+
+    async def iter_items(self, path, params=None, start_page=1, ttl=None):
+        async for __, items in self.iter_pages(path, params, start_page, ttl):
+            for item in items:
+                yield item
+
+    async def get_all(self, path, params=None, ttl=None):
+        return [item async for item in self.iter_items(path, params, ttl=ttl)]
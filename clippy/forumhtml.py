@@ -0,0 +1,181 @@
+from collections import OrderedDict
+from html.entities import codepoint2name
+from html.parser import HTMLParser
+
+# the entity table BeautifulSoup uses, so text comes out the same as get_text()
+_ENTITIES = {name: chr(codepoint) for codepoint, name in codepoint2name.items()}
+# BeautifulSoup turns text made only of these into a single newline or space, outside these tags
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+_PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+# tags its html.parser builder closes as soon as they open
+_VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param',
+    'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'
+}
+
+
+class _EnoughText(Exception):
+    pass
+
+
+class _TextExtractor(HTMLParser):
+    """ Collects text the way BeautifulSoup builds its strings. Text between two tags is one
+    string, and whitespace-only strings are held back until the next tag shows whether
+    they're collapsed. The open tags are tracked as BeautifulSoup tracks them, only to
+    know whether a pre or textarea is open; like it, an end tag with no open match
+    closes every open tag.
+    """
+    def __init__(self, limit=None):
+        super().__init__(convert_charrefs=False)
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+        self._open = []
+        self._closed_voids = []
+        self._preserving = 0
+        self._spaces = None
+        self._in_text = False
+
+    def _emit(self, data):
+        self.parts.append(data)
+        self.length += len(data)
+        if self.limit is not None and self.length > self.limit:
+            raise _EnoughText()
+
+    def _end_data(self):
+        spaces, self._spaces, self._in_text = self._spaces, None, False
+        if spaces is not None:
+            self._emit("\n" if any("\n" in data for data in spaces) else " ")
+
+    def handle_data(self, data):
+        if self._in_text:
+            self._emit(data)
+        elif self._preserving or data.strip(_ASCII_SPACES):
+            self._in_text = True
+            for spaces in self._spaces or ():
+                self._emit(spaces)
+            self._spaces = None
+            self._emit(data)
+        else:
+            if self._spaces is None:
+                self._spaces = []
+            self._spaces.append(data)
+
+    def _push(self, tag):
+        self._open.append(tag)
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self._preserving += 1
+
+    def _pop_to(self, tag):
+        while self._open:
+            name = self._open.pop()
+            if name in _PRESERVE_WHITESPACE_TAGS:
+                self._preserving -= 1
+            if name == tag:
+                break
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        self._push(tag)
+        if tag in _VOID_TAGS:
+            self._pop_to(tag)
+            # a later </br> for it is ignored
+            self._closed_voids.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+        self._push(tag)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_voids:
+            self._closed_voids.remove(tag)
+        else:
+            self._end_data()
+            self._pop_to(tag)
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def close(self):
+        super().close()
+        self._end_data()
+
+    def handle_charref(self, name):
+        # references below 256 are read as windows-1252 first, as BeautifulSoup does
+        if name[0] in 'xX':
+            codepoint = int(name[1:], 16)
+        else:
+            codepoint = int(name)
+        data = None
+        if codepoint < 256:
+            try:
+                data = bytes([codepoint]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(codepoint)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        self.handle_data(_ENTITIES.get(name, f"&{name}"))
+
+    def unknown_decl(self, data):
+        # BeautifulSoup keeps CDATA sections in get_text() as strings of their own, so do the same
+        self._end_data()
+        if data.upper().startswith('CDATA['):
+            self.handle_data(data[6:])
+            self._end_data()
+
+
+def html_to_text(html, limit=None):
+    """ Returns the text of an HTML fragment, matching BeautifulSoup(html, 'html.parser').get_text().
+    No tree is built, and with a limit parsing stops as soon as more than limit
+    characters have been found, so only the first limit + 1 characters of the
+    result are guaranteed.
+    """
+    if not html:
+        return ""
+    parser = _TextExtractor(limit)
+    try:
+        # fed in one piece so malformed markup is tokenized exactly as BeautifulSoup sees it
+        parser.feed(html)
+        parser.close()
+    except _EnoughText:
+        pass
+    return "".join(parser.parts)
+
+
+class TextCache:
+    """ Memoizes html_to_text by post ID so a post is only parsed once.
+    A text extracted with a larger limit is reused for smaller ones.
+    """
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._texts = OrderedDict()
+
+    def text(self, key, html, limit=None):
+        entry = self._texts.get(key)
+        if entry is not None:
+            cached_limit, text = entry
+            if cached_limit is None or (limit is not None and cached_limit >= limit):
+                self._texts.move_to_end(key)
+                return text
+        text = html_to_text(html, limit)
+        self._texts[key] = (limit, text)
+        self._texts.move_to_end(key)
+        while len(self._texts) > self.max_entries:
+            self._texts.popitem(last=False)
+        return text
+
+    def forget(self, key):
+        self._texts.pop(key, None)
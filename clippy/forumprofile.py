@@ -0,0 +1,159 @@
+import os
+from html.parser import HTMLParser
+
+# elements that never get an end tag, so they aren't tracked as open
+_VOID = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+         'track', 'wbr'}
+
+
+class _SeenItem(Exception):
+    pass
+
+
+class ProfileParser(HTMLParser):
+    """ Event-driven parser for a forum profile's comments or discussions page.
+    Records are collected from li.Item (kind "comment") or li.ItemDiscussion
+    (kind "discussion") elements as markup is fed in, and parsing stops at the
+    first record whose ID is in any of the seen containers; profiles list the
+    newest posts first, so everything after it is already known. Feed it chunks
+    as they download and stop reading once done is set.
+    Comment records have id, title (the discussion's) and text (the comment's
+    start); discussion records have id, title, url and category.
+    """
+    def __init__(self, kind, seen=(), text_limit=280):
+        super().__init__(convert_charrefs=True)
+        self.kind = kind
+        self.seen = seen
+        self.text_limit = text_limit
+        self.items = []
+        self.done = False
+        self._item = None
+        self._open = []
+        self._capture = None
+
+    def feed(self, data):
+        if self.done:
+            return
+        try:
+            super().feed(data)
+        except _SeenItem:
+            self.done = True
+
+    def close(self):
+        if not self.done:
+            super().close()
+            self._finish_item()
+        self.done = True
+
+    def _inside(self, tag, css_class):
+        return any(open_tag == tag and css_class in classes for open_tag, classes in self._open)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or "").split()
+        if self._item is None:
+            if tag == 'li' and ('ItemDiscussion' if self.kind == "discussion" else 'Item') in classes:
+                self._start_item(attrs.get('id') or "")
+            if self._item is None:
+                return
+        if tag in _VOID:
+            return
+        self._open.append((tag, classes))
+        if tag != 'a' or self._capture is not None:
+            return
+        if self.kind == "comment" and self._inside('span', 'MItem') and "title" not in self._item:
+            self._capture = "title"
+        elif self.kind == "discussion" and self._inside('div', 'Title') and "title" not in self._item:
+            self._capture = "title"
+            self._item["url"] = attrs.get('href')
+        elif self.kind == "discussion" and self._inside('span', 'Category') and "category" not in self._item:
+            self._capture = "category"
+        if self._capture is not None:
+            self._item[self._capture] = ""
+
+    def _start_item(self, element_id):
+        __, __, item_id = element_id.partition('_')
+        if not item_id.isdigit():
+            return
+        if any(int(item_id) in ids for ids in self.seen):
+            raise _SeenItem()
+        self._item = {"id": int(item_id)}
+        if self.kind == "comment":
+            self._item["text"] = ""
+
+    def handle_endtag(self, tag):
+        if self._item is None:
+            return
+        # unclosed elements inside the one ending are closed with it, as a browser would
+        for index in range(len(self._open) - 1, -1, -1):
+            if self._open[index][0] == tag:
+                del self._open[index:]
+                break
+        else:
+            return
+        if tag == 'a':
+            self._capture = None
+        if not self._open:
+            self._finish_item()
+
+    def _finish_item(self):
+        if self._item is not None:
+            self._item = {key: value.strip() if isinstance(value, str) else value
+                          for key, value in self._item.items()}
+            self.items.append(self._item)
+        self._item, self._open, self._capture = None, [], None
+
+    def handle_data(self, data):
+        if self._item is None:
+            return
+        if self._capture is not None:
+            self._item[self._capture] += data
+        elif self.kind == "comment" and len(self._item["text"]) <= self.text_limit \
+                and self._inside('div', 'Message'):
+            self._item["text"] += data
+
+
+async def scrape_profile(forum, url, kind, seen=()):
+    """ Returns the records of a profile page newer than the first ID in seen, newest first.
+    The page is parsed as it downloads and the download is dropped once a seen ID
+    turns up.
+    """
+    parser = ProfileParser(kind, seen)
+    chunks = forum.iter_text(url)
+    try:
+        async for chunk in chunks:
+            parser.feed(chunk)
+            if parser.done:
+                break
+    finally:
+        # closes the response now rather than whenever the generator is collected
+        await chunks.aclose()
+    parser.close()
+    return parser.items
+
+
+class IdLog:
+    """ Append-only log of post IDs already scraped, one per line.
+    IDs are loaded once into a set; new ones are appended to the file rather
+    than the whole history being rewritten.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.ids = set()
+        if os.path.exists(path):
+            with open(path) as file:
+                self.ids = {int(line) for line in file if line.strip().isdigit()}
+
+    def __contains__(self, item_id):
+        return int(item_id) in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extend(self, item_ids):
+        new_ids = [int(item_id) for item_id in item_ids if int(item_id) not in self.ids]
+        if not new_ids:
+            return
+        with open(self.path, 'a') as file:
+            file.write("".join(f"{item_id}\n" for item_id in new_ids))
+        self.ids.update(new_ids)
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+
+class StaffRoster:
+    """ Merged list of forum staff (Niantic, Moderator and Administrator roles).
+    The three role lists are fetched concurrently and de-duplicated by userID.
+    Once loaded, the roster is always answered from memory; when it is older
+    than ttl seconds a refresh is started in the background.
+    """
+    roles = ["Niantic", "Moderator", "Administrator"]
+
+    def __init__(self, fetch_pages, logger, ttl=300):
+        self.fetch_pages = fetch_pages
+        self.logger = logger
+        self.ttl = ttl
+        self._users = None
+        self._fetched = 0
+        self._refresh_task = None
+
+    def is_fresh(self):
+        return self._users is not None and time.time() - self._fetched < self.ttl
+
+    async def get(self):
+        if self._users is None:
+            return await self.refresh()
+        if not self.is_fresh():
+            self._start_refresh()
+        return self._users
+
+    async def refresh(self):
+        # shielded so a cancelled caller doesn't cancel the refresh other callers are waiting on
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+            self._refresh_task.add_done_callback(self._log_failure)
+        return self._refresh_task
+
+    def _log_failure(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warn(f"Failed to refresh forum staff roster.\nFull error: {task.exception()}")
+
+    async def _refresh(self):
+        role_users = await asyncio.gather(*[self.fetch_pages("users", {"roleID": f"$name:{role}", "limit": 100})
+                                            for role in self.roles])
+        users = {}
+        for role_list in role_users:
+            for user in role_list:
+                users.setdefault(user["userID"], user)
+        self._users = list(users.values())
+        self._fetched = time.time()
+        return self._users
@@ -0,0 +1,140 @@
+import re
+from datetime import timezone
+
+import dateparser
+from peewee import chunked, fn
+
+from clippy.exts.db.clippy_db import CommentTable, DiscussionPostTable, ForumSearchTable
+from clippy.forumhtml import html_to_text
+
+KINDS = ("comment", "discussion")
+# column weights for bm25, in ForumSearchTable column order: title matches count most
+RANK_WEIGHTS = (0, 0, 2.0, 4.0, 1.0, 0, 0)
+_QUERY_PART = re.compile(r'(by|in|after|before):("[^"]*"|\S+)|"([^"]*)"|(\S+)', re.IGNORECASE)
+
+
+def search_rowid(kind, item_id):
+    return int(item_id) * 2 + (1 if kind == "discussion" else 0)
+
+
+def search_row(kind, item_id, author, title, html, date_inserted, url):
+    return {"rowid": search_rowid(kind, item_id),
+            "kind": kind,
+            "itemid": int(item_id),
+            "author": author or "",
+            "title": title or "",
+            "body": html_to_text(html),
+            "dateinserted": date_inserted or "",
+            "url": url or ""}
+
+
+def index_rows(rows):
+    """Adds or replaces rows made by search_row; call inside the transaction that stores the posts"""
+    for batch in chunked(rows, 100):
+        ForumSearchTable.insert_many(batch).on_conflict_replace().execute()
+
+
+def rebuild_index():
+    """ One-off fill of the search index from the stored comments and discussions,
+    for databases created before the index existed.
+    """
+    if ForumSearchTable.select().exists():
+        return 0
+    rows = []
+    titles = {}
+    for post in DiscussionPostTable.select():
+        titles[post.discussionpostid] = post.name
+        if post.forumuser_id is None:
+            continue
+        rows.append(search_row("discussion", post.discussionpostid, post.forumuser_id, post.name,
+                               post.discussionposttext, post.dateinserted, post.url))
+    for comment in CommentTable.select():
+        rows.append(search_row("comment", comment.commentid, comment.forumuser_id,
+                               titles.get(comment.discussionid), comment.commenttext, comment.dateinserted,
+                               comment.url))
+    with ForumSearchTable._meta.database.atomic():
+        index_rows(rows)
+    return len(rows)
+
+
+def _match_term(term):
+    if term.upper() in ("AND", "OR", "NOT"):
+        return term.upper()
+    prefix = term.endswith('*')
+    term = term.rstrip('*').replace('"', '""')
+    if not term:
+        return None
+    return f'"{term}"*' if prefix else f'"{term}"'
+
+
+def _parse_date(text):
+    moment = dateparser.parse(text, settings={'PREFER_DATES_FROM': 'past'})
+    if moment is None:
+        raise ValueError(f"Could not understand the date '{text}'")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def parse_query(text):
+    """ Splits a search into an FTS5 match expression and its filters.
+    Words are matched as terms, "quoted text" as phrases, a trailing * matches
+    prefixes and AND/OR/NOT are passed through. Filters are by:<author>,
+    in:comments|discussions, after:<date> and before:<date>, where dates are
+    anything dateparser understands. Raises ValueError for a bad filter, or for a
+    search that starts with NOT, since FTS5 can only exclude from other matches.
+    """
+    terms = []
+    filters = {}
+    for key, value, phrase, word in _QUERY_PART.findall(text):
+        if key:
+            key, value = key.lower(), value.strip('"')
+            if key == "by":
+                filters["author"] = value
+            elif key == "in":
+                kind = value.lower().rstrip('s')
+                if kind not in KINDS:
+                    raise ValueError(f"in: must be comments or discussions, not '{value}'")
+                filters["kind"] = kind
+            elif key == "after":
+                filters["since"] = _parse_date(value)
+            else:
+                filters["until"] = _parse_date(value)
+        elif phrase.strip():
+            terms.append('"' + phrase.replace('"', '""') + '"')
+        elif word:
+            term = _match_term(word)
+            if term:
+                terms.append(term)
+    # operators need something on both sides
+    while terms and terms[0] in ("AND", "OR"):
+        terms.pop(0)
+    if terms and terms[0] == "NOT":
+        raise ValueError("NOT needs something to search for before it, e.g. criteria NOT photo")
+    while terms and terms[-1] in ("AND", "OR", "NOT"):
+        terms.pop()
+    return " ".join(terms), filters
+
+
+def search(match, author=None, kind=None, since=None, until=None, limit=10):
+    """ Returns the best matches for an FTS5 match expression, best first.
+    author matches any part of the poster's name; since and until are
+    ISO dates (UTC) compared against when the post was made.
+    """
+    table = ForumSearchTable._meta.entity
+    rank = ForumSearchTable.bm25(*RANK_WEIGHTS)
+    query = (ForumSearchTable
+             .select(ForumSearchTable.kind, ForumSearchTable.itemid, ForumSearchTable.author,
+                     ForumSearchTable.title, ForumSearchTable.dateinserted, ForumSearchTable.url,
+                     fn.snippet(table, 4, '**', '**', '...', 24).alias('snippet'),
+                     rank.alias('rank'))
+             .where(ForumSearchTable.match(match)))
+    if author:
+        query = query.where(ForumSearchTable.author.contains(author))
+    if kind:
+        query = query.where(ForumSearchTable.kind == kind)
+    if since:
+        query = query.where(ForumSearchTable.dateinserted >= since)
+    if until:
+        query = query.where(ForumSearchTable.dateinserted < until)
+    return list(query.order_by(rank).limit(limit).dicts())
@@ -0,0 +1,104 @@
+class Leaderboard:
+    """ Users ranked by a count, kept up to date one change at a time.
+    Users are bucketed by count, and a Fenwick tree indexed by count holds how
+    many users have each one. Changing a count, finding a user's rank and
+    finding the k-th highest count each take O(log m) for a highest count m,
+    so top(n) costs O(n log m) however many users there are.
+    Hidden users (members who left the guild) keep their count but are left
+    out of the ranking until shown again. Users with a count of 0 aren't ranked.
+    """
+    def __init__(self, counts=None):
+        self._size = 64
+        self._tree = [0] * (self._size + 1)
+        self._buckets = {}
+        self._counts = {}
+        self._hidden = {}
+        for user_id, count in (counts or {}).items():
+            self.set(user_id, count)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _add(self, count, delta):
+        while count <= self._size:
+            self._tree[count] += delta
+            count += count & -count
+
+    def _prefix(self, count):
+        total = 0
+        count = min(count, self._size)
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def _grow(self, count):
+        while self._size < count:
+            self._size *= 2
+        self._tree = [0] * (self._size + 1)
+        for bucket_count, bucket in self._buckets.items():
+            self._add(bucket_count, len(bucket))
+
+    def _kth_smallest(self, k):
+        # descends the tree to the lowest count with at least k users at or below it
+        position = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            if position + step <= self._size and self._tree[position + step] < k:
+                position += step
+                k -= self._tree[position]
+            step >>= 1
+        return position + 1
+
+    def _place(self, user_id, count):
+        if count > self._size:
+            self._grow(count)
+        self._buckets.setdefault(count, {})[user_id] = None
+        self._counts[user_id] = count
+        self._add(count, 1)
+
+    def _unplace(self, user_id):
+        count = self._counts.pop(user_id)
+        bucket = self._buckets[count]
+        del bucket[user_id]
+        if not bucket:
+            del self._buckets[count]
+        self._add(count, -1)
+        return count
+
+    def set(self, user_id, count):
+        if user_id in self._hidden:
+            self._hidden[user_id] = count
+            return
+        if user_id in self._counts:
+            self._unplace(user_id)
+        if count > 0:
+            self._place(user_id, count)
+
+    def hide(self, user_id):
+        if user_id not in self._hidden:
+            self._hidden[user_id] = self._unplace(user_id) if user_id in self._counts else 0
+
+    def show(self, user_id):
+        count = self._hidden.pop(user_id, None)
+        if count:
+            self._place(user_id, count)
+
+    def rank(self, user_id):
+        """Returns the user's rank, shared with anyone on the same count, or None if unranked"""
+        count = self._counts.get(user_id)
+        if count is None:
+            return None
+        return len(self._counts) - self._prefix(count) + 1
+
+    def top(self, n):
+        """Returns [(user ID, count)] for the n highest counts, highest first"""
+        result = []
+        ranked = len(self._counts)
+        while len(result) < n and len(result) < ranked:
+            count = self._kth_smallest(ranked - len(result))
+            for user_id in self._buckets[count]:
+                result.append((user_id, count))
+                if len(result) >= n:
+                    break
+        return result
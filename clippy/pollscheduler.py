@@ -0,0 +1,48 @@
+import time
+
+
+class PollScheduler:
+    """ Decides when each tracked forum user is next polled.
+    A user who posted since their last poll, or who the forum reports as
+    active since then, is polled again after min_interval seconds. Each poll
+    that finds nothing new doubles their interval, up to max_interval.
+    """
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._state = {}
+
+    def _entry(self, user_id):
+        if user_id not in self._state:
+            # unseen users are due straight away
+            self._state[user_id] = {"interval": self.min_interval, "next_poll": 0, "last_polled": 0}
+        return self._state[user_id]
+
+    def due(self, user_ids, now=None):
+        now = now or time.time()
+        return [user_id for user_id in user_ids if self._entry(user_id)["next_poll"] <= now]
+
+    def saw_activity(self, user_id, last_active, now=None):
+        """Brings a user's next poll forward if they were active on the forum after their last poll"""
+        entry = self._entry(user_id)
+        if last_active > entry["last_polled"]:
+            entry["interval"] = self.min_interval
+            entry["next_poll"] = min(entry["next_poll"], now or time.time())
+
+    def record_poll(self, user_id, found_new, now=None):
+        now = now or time.time()
+        entry = self._entry(user_id)
+        if found_new:
+            entry["interval"] = self.min_interval
+        else:
+            entry["interval"] = min(entry["interval"] * 2, self.max_interval)
+        entry["last_polled"] = now
+        entry["next_poll"] = now + entry["interval"]
+
+    def forget(self, user_id):
+        self._state.pop(user_id, None)
+
+    def schedule(self):
+        """Returns (user_id, next_poll, interval) for every known user, soonest first"""
+        return sorted(((user_id, entry["next_poll"], entry["interval"]) for user_id, entry in self._state.items()),
+                      key=lambda item: item[1])
@@ -0,0 +1,326 @@
+import json
+import os
+from collections import OrderedDict
+
+from peewee import EXCLUDED, chunked, fn
+
+from clippy.exts.db.clippy_db import ClippyDB, CommentTable, DiscussionPostTable, ForumUserTable
+from clippy.forumchanges import comment_hash, discussion_hash
+from clippy.forumsearch import index_rows, search_row
+
+
+def flush_stores(*stores):
+    """ Writes everything staged in the given stores in one transaction.
+    Staged items are only dropped once the transaction has committed, so a
+    failed write is retried on the next flush.
+    """
+    with ClippyDB._db.atomic():
+        for store in stores:
+            store.flush()
+    for store in stores:
+        store.commit()
+
+
+class PostStore:
+    """ Index of the forum discussions the scraper has seen, backed by DiscussionPostTable.
+    Only discussion and category IDs are held in memory; full posts are read from
+    the database when needed, with the most recently used kept in a small LRU.
+    New posts are staged and written by flush_stores. Discussion IDs are always int.
+    Posts stored without an author (parent posts looked up for comments) get
+    one when they're added again with a username.
+    """
+    def __init__(self, recent_limit=512):
+        self.recent_limit = recent_limit
+        self._categories = {}
+        self._authored = set()
+        self._recent = OrderedDict()
+        self._pending = {}
+        self._deleted = {}
+        query = DiscussionPostTable.select(DiscussionPostTable.discussionpostid, DiscussionPostTable.categoryid,
+                                           DiscussionPostTable.forumuser)
+        for discussion_id, category_id, username in query.tuples():
+            self._categories[discussion_id] = category_id
+            if username is not None:
+                self._authored.add(discussion_id)
+
+    def __contains__(self, discussion_id):
+        return int(discussion_id) in self._categories
+
+    def __len__(self):
+        return len(self._categories)
+
+    def has_author(self, discussion_id):
+        return int(discussion_id) in self._authored
+
+    def category(self, discussion_id):
+        return self._categories.get(int(discussion_id))
+
+    def get(self, discussion_id):
+        discussion_id = int(discussion_id)
+        if discussion_id not in self._categories:
+            return None
+        if discussion_id in self._pending:
+            return self._pending[discussion_id][0]
+        post = self._recent.get(discussion_id)
+        if post is not None:
+            self._recent.move_to_end(discussion_id)
+            return post
+        row = DiscussionPostTable.get_or_none(DiscussionPostTable.discussionpostid == discussion_id)
+        if row is None:
+            return None
+        post = self._row_to_post(row)
+        self._remember(post)
+        return post
+
+    def add(self, post, username=None):
+        discussion_id = int(post["discussionID"])
+        if username is None and discussion_id in self._pending:
+            username = self._pending[discussion_id][1]
+        if username is not None:
+            self._authored.add(discussion_id)
+        self._categories[discussion_id] = int(post["categoryID"])
+        self._pending[discussion_id] = (post, username)
+        self._remember(post)
+
+    def flush(self):
+        rows = [self._post_to_row(post, username) for post, username in self._pending.values()]
+        for batch in chunked(rows, 100):
+            DiscussionPostTable.insert_many(batch).on_conflict(
+                conflict_target=[DiscussionPostTable.discussionpostid],
+                preserve=[DiscussionPostTable.discussionposttext, DiscussionPostTable.name,
+                          DiscussionPostTable.categoryid, DiscussionPostTable.insertuserid,
+                          DiscussionPostTable.dateinserted, DiscussionPostTable.dateupdated,
+                          DiscussionPostTable.url, DiscussionPostTable.contenthash],
+                # a post re-added without an author keeps the one it has
+                update={DiscussionPostTable.forumuser: fn.COALESCE(EXCLUDED.forumuser_id,
+                                                                   DiscussionPostTable.forumuser)}).execute()
+        for discussion_id, when in self._deleted.items():
+            DiscussionPostTable.update(datedeleted=when).where(
+                DiscussionPostTable.discussionpostid == discussion_id).execute()
+        # parent posts looked up for comments have no author and are not indexed
+        index_rows([search_row("discussion", row["discussionpostid"], row["forumuser"], row["name"],
+                               row["discussionposttext"], row["dateinserted"], row["url"])
+                    for row in rows if row["forumuser"] is not None])
+
+    def commit(self):
+        self._pending.clear()
+        self._deleted.clear()
+
+    def versions(self, username, first_id, last_id):
+        """Returns {discussion ID: (content hash, dateUpdated)} for username's undeleted posts in the ID range"""
+        query = (DiscussionPostTable
+                 .select(DiscussionPostTable.discussionpostid, DiscussionPostTable.contenthash,
+                         DiscussionPostTable.dateupdated)
+                 .where((DiscussionPostTable.forumuser == username)
+                        & (DiscussionPostTable.discussionpostid.between(first_id, last_id))
+                        & (DiscussionPostTable.datedeleted.is_null())))
+        versions = {discussion_id: (content_hash, date_updated)
+                    for discussion_id, content_hash, date_updated in query.tuples()}
+        for discussion_id, (post, post_username) in self._pending.items():
+            if post_username == username and first_id <= discussion_id <= last_id:
+                versions[discussion_id] = (discussion_hash(post), post["dateUpdated"])
+        for discussion_id in self._deleted:
+            versions.pop(discussion_id, None)
+        return versions
+
+    def mark_deleted(self, discussion_id, when):
+        self._deleted[int(discussion_id)] = when
+
+    def assign_authors(self, authors):
+        """ Sets the author of stored posts that have none from their insertUserID, and indexes them.
+        authors maps user IDs (str) to forum usernames. Returns how many posts were fixed.
+        """
+        query = DiscussionPostTable.select().where(DiscussionPostTable.forumuser.is_null()
+                                                   & DiscussionPostTable.insertuserid.is_null(False))
+        rows = [(row, authors[str(row.insertuserid)]) for row in query if str(row.insertuserid) in authors]
+        if not rows:
+            return 0
+        with ClippyDB._db.atomic():
+            for row, username in rows:
+                DiscussionPostTable.update(forumuser=username).where(DiscussionPostTable.id == row.id).execute()
+            index_rows([search_row("discussion", row.discussionpostid, username, row.name, row.discussionposttext,
+                                   row.dateinserted, row.url) for row, username in rows])
+        self._authored.update(row.discussionpostid for row, __ in rows)
+        return len(rows)
+
+    def import_json(self, filename, authors=None):
+        """ One-off import of the old post_info.json into an empty table.
+        authors maps user IDs (str) to forum usernames, to set the author of staff posts.
+        """
+        if len(self._categories) > 0 or not os.path.exists(filename):
+            return 0
+        with open(filename, 'r') as fd:
+            posts = json.load(fd)
+        for post in posts:
+            self.add(post, (authors or {}).get(str(post.get("insertUserID"))))
+        imported = len(self._pending)
+        flush_stores(self)
+        self._recent.clear()
+        return imported
+
+    def _remember(self, post):
+        discussion_id = int(post["discussionID"])
+        self._recent[discussion_id] = post
+        self._recent.move_to_end(discussion_id)
+        while len(self._recent) > self.recent_limit:
+            self._recent.popitem(last=False)
+
+    @staticmethod
+    def _post_to_row(post, username):
+        return {"discussionpostid": int(post["discussionID"]),
+                "forumuser": username,
+                "discussionposttext": post["body"] or "",
+                "name": post["name"],
+                "categoryid": int(post["categoryID"]),
+                "insertuserid": post["insertUserID"],
+                "dateinserted": post.get("dateInserted"),
+                "dateupdated": post["dateUpdated"],
+                "url": post["url"],
+                "contenthash": discussion_hash(post)}
+
+    @staticmethod
+    def _row_to_post(row):
+        return {"discussionID": row.discussionpostid,
+                "name": row.name,
+                "body": row.discussionposttext,
+                "categoryID": row.categoryid,
+                "dateInserted": row.dateinserted,
+                "dateUpdated": row.dateupdated,
+                "insertUserID": row.insertuserid,
+                "url": row.url
+                }
+
+
+class CommentStore:
+    """ Staff comments captured by the scraper, staged until the next flush_stores.
+    title is the name of the comment's discussion, used by the search index.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._titles = {}
+        self._deleted = {}
+
+    def add(self, comment, username, title=None):
+        self._titles[int(comment["commentID"])] = title
+        self._pending[int(comment["commentID"])] = {
+            "commentid": int(comment["commentID"]),
+            "forumuser": username,
+            "commenttext": comment["body"] or "",
+            "discussionid": int(comment["discussionID"]),
+            "dateinserted": comment["dateInserted"],
+            "dateupdated": comment.get("dateUpdated"),
+            "url": comment["url"],
+            "contenthash": comment_hash(comment)
+        }
+
+    def flush(self):
+        for batch in chunked(list(self._pending.values()), 100):
+            CommentTable.insert_many(batch).on_conflict(
+                conflict_target=[CommentTable.commentid],
+                preserve=[CommentTable.commenttext, CommentTable.dateupdated, CommentTable.url,
+                          CommentTable.contenthash]).execute()
+        for comment_id, when in self._deleted.items():
+            CommentTable.update(datedeleted=when).where(CommentTable.commentid == comment_id).execute()
+        index_rows([search_row("comment", row["commentid"], row["forumuser"], self._titles.get(row["commentid"]),
+                               row["commenttext"], row["dateinserted"], row["url"])
+                    for row in self._pending.values()])
+
+    def commit(self):
+        self._pending.clear()
+        self._titles.clear()
+        self._deleted.clear()
+
+    def versions(self, username, first_id, last_id):
+        """Returns {comment ID: (content hash, dateUpdated)} for username's undeleted comments in the ID range"""
+        query = (CommentTable
+                 .select(CommentTable.commentid, CommentTable.contenthash, CommentTable.dateupdated)
+                 .where((CommentTable.forumuser == username)
+                        & (CommentTable.commentid.between(first_id, last_id))
+                        & (CommentTable.datedeleted.is_null())))
+        versions = {comment_id: (content_hash, date_updated)
+                    for comment_id, content_hash, date_updated in query.tuples()}
+        for comment_id, row in self._pending.items():
+            if row["forumuser"] == username and first_id <= comment_id <= last_id:
+                versions[comment_id] = (row["contenthash"], row["dateupdated"])
+        for comment_id in self._deleted:
+            versions.pop(comment_id, None)
+        return versions
+
+    def text(self, comment_id):
+        """Returns the stored body of a comment, or None"""
+        comment_id = int(comment_id)
+        if comment_id in self._pending:
+            return self._pending[comment_id]["commenttext"]
+        row = CommentTable.get_or_none(CommentTable.commentid == comment_id)
+        return row.commenttext if row is not None else None
+
+    def discussion_id(self, comment_id):
+        """Returns the ID of the discussion a stored comment is on, or None"""
+        comment_id = int(comment_id)
+        if comment_id in self._pending:
+            return self._pending[comment_id]["discussionid"]
+        row = CommentTable.get_or_none(CommentTable.commentid == comment_id)
+        return row.discussionid if row is not None else None
+
+    def mark_deleted(self, comment_id, when):
+        self._deleted[int(comment_id)] = when
+
+
+class StaffStore:
+    """ Tracked forum staff and their scrape cursors, stored in ForumUserTable.
+    users keeps the shape of the old nia_users.json; flush only writes users
+    whose name or cursors changed since they were last saved.
+    """
+    def __init__(self):
+        self.users = {}
+        self._saved = {}
+        query = ForumUserTable.select().where(ForumUserTable.userid.is_null(False)).order_by(ForumUserTable.id)
+        for row in query:
+            # a renamed user keeps their old row, so the newest row per userid wins
+            self.users[str(row.userid)] = {
+                "userID": row.userid,
+                "name": row.username,
+                "exclude_categories": row.excludecategories or [],
+                "last_comments_page": row.lastcommentspage or 1,
+                "last_discussions_page": row.lastdiscussionspage or 1,
+                "latest_comment": row.latestcomment or 0,
+                "latest_discussion": row.latestdiscussion or 0
+            }
+        for user_id, user in self.users.items():
+            self._saved[user_id] = self._snapshot(user)
+
+    @staticmethod
+    def _snapshot(user):
+        return (user["name"], tuple(user["exclude_categories"]), user["last_comments_page"],
+                user["last_discussions_page"], user["latest_comment"], user["latest_discussion"])
+
+    def _changed(self):
+        return {user_id: user for user_id, user in self.users.items()
+                if self._saved.get(user_id) != self._snapshot(user)}
+
+    def flush(self):
+        for user in self._changed().values():
+            ForumUserTable.insert(username=user["name"],
+                                  userid=user["userID"],
+                                  excludecategories=user["exclude_categories"],
+                                  lastcommentspage=user["last_comments_page"],
+                                  lastdiscussionspage=user["last_discussions_page"],
+                                  latestcomment=user["latest_comment"],
+                                  latestdiscussion=user["latest_discussion"]).on_conflict(
+                conflict_target=[ForumUserTable.username],
+                preserve=[ForumUserTable.userid, ForumUserTable.excludecategories,
+                          ForumUserTable.lastcommentspage, ForumUserTable.lastdiscussionspage,
+                          ForumUserTable.latestcomment, ForumUserTable.latestdiscussion]).execute()
+
+    def commit(self):
+        for user_id, user in self.users.items():
+            self._saved[user_id] = self._snapshot(user)
+
+    def import_json(self, filename):
+        """One-off import of the old nia_users.json when no staff are stored yet"""
+        if len(self.users) > 0 or not os.path.exists(filename):
+            return 0
+        with open(filename, 'r') as fd:
+            self.users.update(json.load(fd))
+        flush_stores(self)
+        return len(self.users)
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from collections import Counter
+
+from peewee import fn
+
+from clippy.exts.db.clippy_db import ClippyDB, ReactionDeltaTable, ReactionStateTable
+
+
+def tally(reactions):
+    """Counts API-shaped reactions by reaction type"""
+    return Counter(reaction["reactionType"]["name"] for reaction in reactions)
+
+
+class ReactionHistory:
+    """ Stored reaction lists for forum comments and discussions, and the history of their counts.
+    The forum appends new reactions to the end of the list, so a fetch starts at
+    the page holding the last stored reaction and only pages from there on are
+    requested. If that page no longer lines up with what was stored (reactions
+    were removed), the whole list is fetched again. The next two pages are fetched
+    one at a time, so short lists cost no more requests than they have pages; after
+    that, while pages keep coming back full, each round fetches twice as many at
+    once, up to concurrency.
+    Every fetch is a snapshot: the change in each reaction type's count is stored
+    as a delta in ReactionDeltaTable when anything changed.
+    kind is "comment" or "discussion".
+    """
+    def __init__(self, forum, page_size=100, concurrency=4):
+        self.forum = forum
+        self.page_size = page_size
+        self.concurrency = concurrency
+
+    @staticmethod
+    def _compact(reaction):
+        return [reaction["user"]["userID"], reaction["user"]["name"], reaction["reactionType"]["name"]]
+
+    @staticmethod
+    def _expand(compact):
+        user_id, name, reaction_type = compact
+        return {"user": {"userID": user_id, "name": name}, "reactionType": {"name": reaction_type}}
+
+    async def fetch(self, kind, item_id):
+        """ Returns the post's current reactions, shaped like the forum API's.
+        Raises ForumRequestError if the post doesn't exist or the forum fails.
+        """
+        item_id = int(item_id)
+        state = ReactionStateTable.get_or_none((ReactionStateTable.kind == kind)
+                                               & (ReactionStateTable.itemid == item_id))
+        known = state.reactions if state is not None else []
+        reactions = await self._fetch_after(kind, item_id, known)
+        if reactions is None:
+            reactions = await self._fetch_after(kind, item_id, [])
+        self._save(kind, item_id, known, reactions)
+        return [self._expand(compact) for compact in reactions]
+
+    async def _fetch_after(self, kind, item_id, known):
+        """Returns known with the reactions added since, or None if known no longer lines up with the forum"""
+        # the page holding the last known reaction is fetched again to check it still lines up
+        start_page = (len(known) - 1) // self.page_size + 1 if known else 1
+        reactions = known[:(start_page - 1) * self.page_size]
+        expected = [(user_id, reaction_type) for user_id, __, reaction_type in known[len(reactions):]]
+        path = f"{kind}s/{item_id}/reactions"
+        page, batch_size, last_bounds = start_page, 1, None
+        while True:
+            page_numbers = list(range(page, page + batch_size))
+            results = await asyncio.gather(*[self.forum.get_json(path, {"limit": self.page_size, "page": number})
+                                             for number in page_numbers])
+            for number, items in zip(page_numbers, results):
+                items = [self._compact(reaction) for reaction in items or []]
+                if number == start_page and known:
+                    if [(user_id, reaction_type) for user_id, __, reaction_type in items[:len(expected)]] != expected:
+                        return None
+                # past the end some endpoints serve the last page again
+                bounds = (items[0], items[-1]) if items else None
+                if bounds is None or bounds == last_bounds:
+                    return reactions
+                reactions += items
+                if len(items) < self.page_size:
+                    return reactions
+                last_bounds = bounds
+            page += batch_size
+            if page > start_page + 2:
+                batch_size = min(batch_size * 2, self.concurrency)
+
+    def _save(self, kind, item_id, known, reactions):
+        now = int(time.time())
+        deltas = Counter(reaction_type for __, __, reaction_type in reactions)
+        deltas.subtract(reaction_type for __, __, reaction_type in known)
+        deltas = {reaction_type: count for reaction_type, count in deltas.items() if count}
+        with ClippyDB._db.atomic():
+            # another fetch of the same item may have stored its first state since this one was read
+            ReactionStateTable.insert(kind=kind, itemid=item_id, reactions=reactions, datefetched=now).on_conflict(
+                conflict_target=[ReactionStateTable.kind, ReactionStateTable.itemid],
+                preserve=[ReactionStateTable.reactions, ReactionStateTable.datefetched]).execute()
+            if deltas:
+                ReactionDeltaTable.create(kind=kind, itemid=item_id, datetaken=now, deltas=deltas)
+
+    @staticmethod
+    def history(kind, item_id):
+        """Returns [(timestamp, {reaction type: count})] for every snapshot that changed something, oldest first"""
+        totals = Counter()
+        snapshots = []
+        query = (ReactionDeltaTable.select(ReactionDeltaTable.datetaken, ReactionDeltaTable.deltas)
+                 .where((ReactionDeltaTable.kind == kind) & (ReactionDeltaTable.itemid == int(item_id)))
+                 .order_by(ReactionDeltaTable.datetaken, ReactionDeltaTable.id))
+        for taken, deltas in query.tuples():
+            totals.update(deltas)
+            snapshots.append((taken, {reaction_type: count for reaction_type, count in totals.items() if count}))
+        return snapshots
+
+    @staticmethod
+    def watch(kind, item_id, seconds):
+        """Snapshots the post periodically for the next seconds; extends an existing watch"""
+        until = int(time.time() + seconds)
+        ReactionStateTable.insert(kind=kind, itemid=int(item_id), reactions=[], datefetched=0,
+                                  watchuntil=until).on_conflict(
+            conflict_target=[ReactionStateTable.kind, ReactionStateTable.itemid],
+            update={ReactionStateTable.watchuntil: fn.MAX(fn.IFNULL(ReactionStateTable.watchuntil, 0),
+                                                          until)}).execute()
+
+    @staticmethod
+    def unwatch(kind, item_id):
+        return ReactionStateTable.update(watchuntil=None).where(
+            (ReactionStateTable.kind == kind) & (ReactionStateTable.itemid == int(item_id))).execute()
+
+    @staticmethod
+    def watched(older_than):
+        """Returns (kind, item ID) of watched posts last fetched before older_than"""
+        now = time.time()
+        query = (ReactionStateTable.select(ReactionStateTable.kind, ReactionStateTable.itemid)
+                 .where((ReactionStateTable.watchuntil > now) & (ReactionStateTable.datefetched < older_than))
+                 .order_by(ReactionStateTable.datefetched))
+        return list(query.tuples())
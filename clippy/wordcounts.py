@@ -0,0 +1,113 @@
+from peewee import chunked
+
+from clippy.exts.db.clippy_db import ClippyDB, WordCountTable
+from clippy.leaderboard import Leaderboard
+
+
+class WordCountStore:
+    """ Per-user counts of counted words, held in memory and written behind to WordCountTable.
+    Counts are read and incremented in memory; an increment only marks its
+    (guild, word, user) key dirty. flush() upserts the current totals of the
+    dirty keys in one transaction, so a flush costs as much as the changes
+    since the last one and a crash loses at most what wasn't flushed yet.
+    User IDs are str in memory, as in the old word_counts.json.
+    """
+    def __init__(self):
+        self._counts = {}
+        self._boards = {}
+        self._dirty = set()
+        self._cleared = set()
+
+    def load(self):
+        self._counts = {}
+        self._boards = {}
+        query = WordCountTable.select(WordCountTable.guildid, WordCountTable.word, WordCountTable.userid,
+                                      WordCountTable.count)
+        for guild_id, word, user_id, count in query.tuples():
+            self._counts.setdefault((guild_id, word), {})[str(user_id)] = count
+
+    def counts(self, guild_id, word):
+        """Returns {user ID: count} for a guild's counted word"""
+        return self._counts.setdefault((guild_id, word), {})
+
+    def increment(self, guild_id, word, user_id, amount=1):
+        counts = self.counts(guild_id, word)
+        user_id = str(user_id)
+        counts[user_id] = counts.get(user_id, 0) + amount
+        self._dirty.add((guild_id, word, user_id))
+        board = self._boards.get((guild_id, word))
+        if board is not None:
+            board.set(user_id, counts[user_id])
+        return counts[user_id]
+
+    def leaderboard(self, guild_id, word, is_member=None):
+        """ Returns the Leaderboard of a guild's word. It is built from the counts the first
+        time it's asked for and kept up to date by increment() from then on; users for
+        whom is_member returns False are hidden when it's built.
+        """
+        board = self._boards.get((guild_id, word))
+        if board is None:
+            counts = self.counts(guild_id, word)
+            board = Leaderboard(counts)
+            if is_member is not None:
+                for user_id in counts:
+                    if not is_member(user_id):
+                        board.hide(user_id)
+            self._boards[(guild_id, word)] = board
+        return board
+
+    def hide_user(self, guild_id, user_id):
+        """Leaves a user out of the guild's leaderboards, e.g. after they leave"""
+        for (board_guild_id, __), board in self._boards.items():
+            if board_guild_id == guild_id:
+                board.hide(str(user_id))
+
+    def show_user(self, guild_id, user_id):
+        for (board_guild_id, __), board in self._boards.items():
+            if board_guild_id == guild_id:
+                board.show(str(user_id))
+
+    def reset(self, guild_id, word):
+        """Drops every count of a guild's word"""
+        self.counts(guild_id, word).clear()
+        self._boards.pop((guild_id, word), None)
+        self._dirty = {key for key in self._dirty if key[:2] != (guild_id, word)}
+        self._cleared.add((guild_id, word))
+
+    def import_counts(self, guild_id, word, counts):
+        """Takes counts from the old JSON format for users that have none here yet"""
+        stored = self.counts(guild_id, word)
+        self._boards.pop((guild_id, word), None)
+        for user_id, count in counts.items():
+            if str(user_id) not in stored:
+                stored[str(user_id)] = count
+                self._dirty.add((guild_id, word, str(user_id)))
+
+    @property
+    def pending(self):
+        return len(self._dirty) + len(self._cleared)
+
+    def flush(self):
+        """Writes the dirty counts and returns how many rows were written"""
+        dirty, cleared = self._dirty, self._cleared
+        if not dirty and not cleared:
+            return 0
+        self._dirty, self._cleared = set(), set()
+        rows = [{"guildid": guild_id, "word": word, "userid": int(user_id),
+                 "count": self._counts[(guild_id, word)][user_id]}
+                for guild_id, word, user_id in dirty]
+        try:
+            with ClippyDB._db.atomic():
+                for guild_id, word in cleared:
+                    WordCountTable.delete().where((WordCountTable.guildid == guild_id)
+                                                  & (WordCountTable.word == word)).execute()
+                for batch in chunked(rows, 100):
+                    WordCountTable.insert_many(batch).on_conflict(
+                        conflict_target=[WordCountTable.guildid, WordCountTable.word, WordCountTable.userid],
+                        preserve=[WordCountTable.count]).execute()
+        except Exception:
+            # keep them staged so the next flush retries
+            self._dirty |= dirty
+            self._cleared |= cleared
+            raise
+        return len(rows)
@@ -0,0 +1,81 @@
+import re
+
+_TOKEN = re.compile(r'\w+')
+
+
+class KeywordMatcher:
+    """ Finds which of a guild's react-list and counter words occur in a message, in one pass.
+    A word made only of word characters matches r'\bword\b' exactly when it is
+    one of the message's \w+ tokens, so those words are looked up in a dict per
+    token; counter words also match with any number of trailing s's. Anything
+    else (phrases, punctuation, regex) is compiled once and searched on its own.
+    Words are added and removed one at a time, so the matcher never needs a
+    full rebuild when a list changes.
+    """
+    def __init__(self):
+        self._words = {}
+        self._plurals = {}
+        self._patterns = {}
+
+    def __bool__(self):
+        return bool(self._words or self._plurals or self._patterns)
+
+    @staticmethod
+    def _is_token(word):
+        return _TOKEN.fullmatch(word) is not None
+
+    @staticmethod
+    def _compile(word, plural):
+        suffix = r"(s)*\b" if plural else r"\b"
+        try:
+            return re.compile(fr"\b{word}{suffix}")
+        except re.error:
+            return re.compile(fr"\b{re.escape(word)}{suffix}")
+
+    def add(self, key, word, plural=False):
+        """Reports key when word occurs; plural lets it match with trailing s's, as word counters do"""
+        if self._is_token(word):
+            self._index(plural).setdefault(word, set()).add(key)
+        else:
+            self._patterns.setdefault((word, plural), [self._compile(word, plural), set()])[1].add(key)
+
+    def remove(self, key, word, plural=False):
+        if self._is_token(word):
+            keys = self._index(plural).get(word)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index(plural)[word]
+        else:
+            entry = self._patterns.get((word, plural))
+            if entry is not None:
+                entry[1].discard(key)
+                if not entry[1]:
+                    del self._patterns[(word, plural)]
+
+    def _index(self, plural):
+        return self._plurals if plural else self._words
+
+    def matches(self, text):
+        """Returns the set of keys with a word in text"""
+        found = set()
+        if self._words or self._plurals:
+            for token in set(_TOKEN.findall(text)):
+                keys = self._words.get(token)
+                if keys:
+                    found |= keys
+                if not self._plurals:
+                    continue
+                # word(s)* can match the token with any run of its trailing s's removed
+                end = len(token)
+                while end > 0:
+                    keys = self._plurals.get(token[:end])
+                    if keys:
+                        found |= keys
+                    if token[end - 1] != 's':
+                        break
+                    end -= 1
+        for pattern, keys in self._patterns.values():
+            if not keys <= found and pattern.search(text):
+                found |= keys
+        return found